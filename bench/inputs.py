@@ -0,0 +1,82 @@
+import random
+
+# input generators for the example grammars in tests/ and synthetic grammars that scale by size
+
+def math_flat(terms: int, seed: int = 0) -> str:
+    # a long expression with shallow parentheses and unary minus
+    rng = random.Random(seed)
+    atoms = ["1", "2.5", "-3", "(4 * 5)", "-(6 - 7.25)", ".5"]
+    out = [rng.choice(atoms)]
+    for _ in range(terms - 1):
+        out.append(rng.choice("+-*/"))
+        out.append(rng.choice(atoms))
+    return " ".join(out)
+
+def math_nested(depth: int) -> str:
+    # (1 + (2 * (3 - ... ))) nested depth levels deep
+    ops = "+*-"
+    return "".join(f"({i % 9 + 1} {ops[i % 3]} " for i in range(depth)) + "1" + ")" * depth
+
+def def_program(definitions: int, statements: int = 5, seed: int = 0) -> str:
+    # definitions are separated by spaces, the grammar has no newline between them
+    rng = random.Random(seed)
+    atoms = ["1", "2.5", "(3)", "((4))", ".75"]
+    out = ["public define main\n    print 1\nend"]
+    for i in range(definitions - 1):
+        body = "".join(f"    print {rng.choice(atoms)}\n" for _ in range(statements))
+        out.append(f"define f{i}\n{body}end")
+    return " ".join(out)
+
+def chain_grammar(levels: int) -> str:
+    # one BINARY layer per precedence level, each with its own operator token
+    lexer = "\n".join(f'    op{i} "<{i}>"' for i in range(levels))
+    layers = "\n".join(f"    L{i} {{\n        BINARY(L{i+1} ([op{i}])) -> 1\n    }} L{i+1}" for i in range(levels))
+    return f"""NAME chain
+LEXER {{
+    IGNORE " " "\\n"
+    VALUE int "[0-9]+"
+    lp "\\("
+    rp "\\)"
+{lexer}
+}}
+PARSER {{
+{layers}
+    L{levels} {{
+        [int] -> Int tok=1
+        [lp] L0 [rp] -> 2
+    }}
+}} L0
+"""
+
+def chain_input(terms: int, levels: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    out = [str(rng.randrange(100))]
+    for _ in range(terms - 1):
+        out.append(f"<{rng.randrange(levels)}>")
+        out.append(str(rng.randrange(100)) if rng.random() < .9 else f"({rng.randrange(100)} <0> 1)")
+    return " ".join(out)
+
+def wide_grammar(alternatives: int) -> str:
+    # one statement layer with an alternative per keyword, all of them value tokens
+    lexer = "\n".join(f'    k{i} "k{i}:"' for i in range(alternatives))
+    alts = "\n".join(f"        [k{i}] [int] [semi] -> S{i} value=2" for i in range(alternatives))
+    return f"""NAME wide
+LEXER {{
+    IGNORE " " "\\n"
+    VALUE int "[0-9]+"
+    semi ";"
+{lexer}
+}}
+PARSER {{
+    Statement {{
+{alts}
+    }}
+    Program {{
+        Statement* [eof] -> Program body=1
+    }}
+}} Program
+"""
+
+def wide_input(statements: int, alternatives: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return "\n".join(f"k{rng.randrange(alternatives)}: {rng.randrange(1000)};" for _ in range(statements))
@@ -0,0 +1,143 @@
+import argparse, contextlib, importlib.util, io, json, os, platform, sys, tempfile, time, tracemalloc
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import src
+from src import lexer, parser, transform, llp, cache, optimize, analyze
+import inputs
+
+# times the stages of main.generate for each grammar and llp.lex, llp.parse and the example
+# interpreters for each input, best of --repeat runs, plus the peak memory of one traced run
+
+def example(name: str, cls: str):
+    # the interpreter class of an example script in tests/, the scripts only run when executed
+    spec = importlib.util.spec_from_file_location(f"example_{name}", os.path.join(ROOT, "tests", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, cls)
+
+def measure(f, repeat: int) -> tuple:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        value = f()
+        dt = time.perf_counter() - t0
+        if best is None or dt < best: best = dt
+    tracemalloc.start()
+    try:
+        f()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally: tracemalloc.stop()
+    return value, {"seconds": best, "peak_bytes": peak}
+
+def grammar_stages(name: str, text: str, repeat: int, results: dict) -> tuple:
+    key = f"grammar/{name}"
+    tokens, results[f"{key}/tokenize"] = measure(lambda: lexer.tokenize(name, text), repeat)
+    tokens, err = tokens
+    if err: exit(str(err))
+    body, results[f"{key}/parse"] = measure(lambda: parser.parse(tokens), repeat)
+    body, err = body
+    if err: exit(str(err))
+    # transform links the parsed grammar in place, so every run gets a fresh parse
+    lang, results[f"{key}/transform"] = measure(lambda: transform.transform(parser.parse(tokens)[0]), repeat)
+    lang, err = lang
+    if err: exit(str(err))
+    with tempfile.TemporaryDirectory() as tmp:
+        fn = os.path.join(tmp, name + ".llp")
+        cache.store(fn, text, lang)
+        _, results[f"{key}/cache_load"] = measure(lambda: cache.load(fn, text), repeat)
+    _, results[f"{key}/analyze"] = measure(lambda: analyze.analyze(lang), repeat)
+    # a fresh transform with the optimizer pass run on it
+    def optimized():
+        lang, _ = transform.transform(parser.parse(tokens)[0])
+        optimize.optimize(lang)
+        return lang
+    opt, results[f"{key}/optimize"] = measure(optimized, repeat)
+    for stage in ("tokenize", "parse", "transform", "cache_load", "analyze", "optimize"): results[f"{key}/{stage}"]["size"] = len(text)
+    return lang, opt
+
+def cases(scale: float) -> list:
+    # (name, grammar, input text, interpreter class, memo). a BINARY layer without an operator
+    # fails and its link matches the operand again, so nested parentheses and long precedence
+    # chains take exponential time without a memo
+    n = lambda x: max(1, int(x * scale))
+    return [
+        ("math_flat", "math", inputs.math_flat(n(3000)), ("math", "Math"), False),
+        ("math_nested", "math", inputs.math_nested(n(150)), ("math", "Math"), True),
+        ("def_program", "def", inputs.def_program(n(2000)), ("def", "Def"), False),
+        ("chain_30", "chain_30", inputs.chain_input(n(3000), 30), None, True),
+        ("wide_200", "wide_200", inputs.wide_input(n(5000), 200), None, False),
+    ]
+
+def grammars() -> dict:
+    out = {}
+    for name in ("math", "def"):
+        with open(os.path.join(ROOT, "tests", f"{name}.llp")) as f: out[name] = f.read()
+    out["chain_30"] = inputs.chain_grammar(30)
+    out["wide_200"] = inputs.wide_grammar(200)
+    return out
+
+def run(scale: float, repeat: int, only: str = None) -> dict:
+    results, langs = {}, {}
+    selected = [case for case in cases(scale) if not only or only in case[0]]
+    for name, text in grammars().items():
+        if only and only not in name and not any(case[1] == name for case in selected): continue
+        langs[name] = grammar_stages(name, text, repeat, results)
+    for name, grammar, text, interpreter, memo in selected:
+        lang, opt = langs[grammar]
+        tokens, results[f"{name}/lex"] = measure(lambda: llp.lex(name, text, lang.lexer), repeat)
+        tokens, err = tokens
+        if err: exit(str(err))
+        results[f"{name}/lex"]["size"] = len(text)
+        _, results[f"{name}/lex_dfa"] = measure(lambda: llp.lex_dfa(name, text, lang.lexer), repeat)
+        results[f"{name}/lex_dfa"]["size"] = len(text)
+        ast, results[f"{name}/parse"] = measure(lambda: llp.parse(tokens, lang.parser, lang.error, memo=llp.Memo() if memo else None), repeat)
+        ast, err = ast
+        if err: exit(str(err))
+        results[f"{name}/parse"]["size"] = len(tokens)
+        _, results[f"{name}/parse_optimized"] = measure(lambda: llp.parse(tokens, opt.parser, opt.error, memo=llp.Memo() if memo else None), repeat)
+        results[f"{name}/parse_optimized"]["size"] = len(tokens)
+        if interpreter:
+            cls = example(*interpreter)
+            def interpret():
+                with contextlib.redirect_stdout(io.StringIO()): return cls().enter(ast)
+            _, results[f"{name}/interpret"] = measure(interpret, repeat)
+            results[f"{name}/interpret"]["size"] = len(tokens)
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float) -> int:
+    # prints the time ratio against the baseline per stage and returns the number of regressions
+    slower = 0
+    print(f"{'stage':<34}{'baseline':>10}{'now':>10}{'ratio':>8}")
+    for key, r in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<34}{'-':>10}{r['seconds']:>10.4f}")
+            continue
+        ratio = r["seconds"] / base["seconds"] if base["seconds"] else float("inf")
+        mark = "  slower" if ratio > 1 + threshold else "  faster" if ratio < 1 - threshold else ""
+        if mark == "  slower": slower += 1
+        print(f"{key:<34}{base['seconds']:>10.4f}{r['seconds']:>10.4f}{ratio:>8.2f}{mark}")
+    return slower
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(prog="bench", description="time and measure llp stages on generated inputs")
+    args.add_argument("-o", "--output", help="write the results as json")
+    args.add_argument("-c", "--compare", help="json results of an earlier run to compare against")
+    args.add_argument("--scale", type=float, default=1.0, help="multiplies every input size")
+    args.add_argument("--repeat", type=int, default=3)
+    args.add_argument("--threshold", type=float, default=0.1, help="time change that counts as a regression")
+    args.add_argument("--only", help="only run stages whose case or grammar name contains this")
+    args = args.parse_args()
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    results = run(args.scale, args.repeat, args.only)
+    data = {"llp": src.__version__, "python": platform.python_version(), "platform": platform.platform(),
+            "scale": args.scale, "repeat": args.repeat, "results": results}
+    if args.output:
+        with open(args.output, "w") as f: json.dump(data, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+        if baseline.get("scale") != args.scale: print(f"baseline ran at scale {baseline.get('scale')}, not {args.scale}")
+        if compare(results, baseline["results"], args.threshold): exit(1)
+    else:
+        print(f"{'stage':<34}{'size':>9}{'seconds':>10}{'peak kB':>10}")
+        for key, r in results.items(): print(f"{key:<34}{r['size']:>9}{r['seconds']:>10.4f}{r['peak_bytes'] // 1024:>10}")
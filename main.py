@@ -1,39 +1,181 @@
-from src import lexer, parser, transform, llp
-
-class Interpreter:
-    def visit(self, node: dict):
-        if type(node) is not dict: exit(f"cannot visit node of type {type(node).__name__}")
-        method_name = f"visit_{node['type']}"
-        method = getattr(self, method_name, self.no_visit_method)
-        return method(node)
-    def no_visit_method(self, node):
-        exit(f"no visit_{node['type']} method defined in interpreter")
-    def enter(self, node):
-        return self.visit(node)
-
-def generate(llp_fn: str, fn: str, debug: bool = False) -> dict:
-    with open(llp_fn, "r") as f:
-        tokens, err = lexer.tokenize(llp_fn, f.read())
-        if err: exit(str(err))
-        # for tok in tokens: print(tok)
-        body, err = parser.parse(tokens)
-        if err: exit(str(err))
-        # print(body)
-        lang, err = transform.transform(body)
-        if err: exit(str(err))
-        # print(language.convTree("", ". "))
-        ast, err = llp.from_file(fn, lang, debug)
-        if err: exit(str(err))
-        return ast
-
-def run(interpreter, llp_fn: str, fn: str, debug: bool = False):
-    ast = generate(llp_fn, fn, debug)
-    math = interpreter()
-    out = math.enter(ast)
-    if out[-1]: exit(str(out[-1]))
-    if out[0] is not None: print(out[0])
-
-
-if __name__ == '__main__':
-    ast = generate("tests/math.llp", "test.math")
-    print(ast)
\ No newline at end of file
+import argparse, inspect, sys
+from collections.abc import Mapping
+from src import lexer, parser, transform, llp, cache, compiler, profiler, optimize, analyze
+
+class Interpreter:
+    # node type -> visit method, built once per class
+    dispatch = {}
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch = {name[6:]: getattr(cls, name) for name in dir(cls) if name.startswith("visit_")}
+    def visit(self, node: Mapping):
+        if type(node) is not dict and not isinstance(node, Mapping): exit(f"cannot visit node of type {type(node).__name__}")
+        method = self.dispatch.get(node["type"])
+        if method is None: return self.no_visit_method(node)
+        return method(self, node)
+    def no_visit_method(self, node):
+        exit(f"no visit_{node['type']} method defined in interpreter")
+    def enter(self, node):
+        return self.visit(node)
+
+class StackInterpreter(Interpreter):
+    # visit methods may be generators that yield a child node to get its result sent back and
+    # return their own result, they run on an explicit stack so deep trees need no recursion.
+    # plain visit methods are called directly
+    generators = set()
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.generators = {method for method in cls.dispatch.values() if inspect.isgeneratorfunction(method)}
+    def visit(self, node: Mapping):
+        dispatch, generators, no_visit_method = self.dispatch, self.generators, self.no_visit_method
+        stack, child = [], node
+        while True:
+            if type(child) is not dict and not isinstance(child, Mapping): exit(f"cannot visit node of type {type(child).__name__}")
+            method = dispatch.get(child["type"])
+            if method is None: value = no_visit_method(child)
+            elif method in generators:
+                stack.append(method(self, child))
+                value = None
+            else: value = method(self, child)
+            # resume the innermost visit until one yields another child
+            while stack:
+                try:
+                    child = stack[-1].send(value)
+                    break
+                except StopIteration as stop:
+                    stack.pop()
+                    value = stop.value
+            else: return value
+
+def load_language(llp_fn: str, use_cache: bool = True, analyzed: bool = False) -> transform.Language:
+    # analyzed runs the grammar analyzer on the language, see src/analyze.py: warnings are printed
+    # to stderr and errors, grammars the parser never finishes on, exit
+    with open(llp_fn, "r") as f:
+        text = f.read()
+    if use_cache:
+        lang = cache.load(llp_fn, text)
+        if lang: return check_grammar(lang) if analyzed else lang
+    tokens, err = lexer.tokenize(llp_fn, text)
+    if err: exit(str(err))
+    # for tok in tokens: print(tok)
+    body, err = parser.parse(tokens)
+    if err: exit(str(err))
+    # print(body)
+    lang, err = transform.transform(body)
+    if err: exit(str(err))
+    # print(language.convTree("", ". "))
+    if use_cache: cache.store(llp_fn, text, lang)
+    return check_grammar(lang) if analyzed else lang
+
+def check_grammar(lang: transform.Language) -> transform.Language:
+    findings, err = analyze.analyze(lang)
+    if err: exit(str(err))
+    errors = [f for f in findings if f.severity == analyze.ERROR]
+    if errors: exit("\n".join(map(str, errors)))
+    for f in findings:
+        if f.severity == analyze.WARNING: print(f, file=sys.stderr)
+    return lang
+
+def load_optimized(llp_fn: str, use_cache: bool = True, analyzed: bool = False) -> tuple:
+    # (language, changes) with the optimizer pass run on the loaded language, see src/optimize.py
+    lang = load_language(llp_fn, use_cache, analyzed)
+    changes, err = optimize.optimize(lang)
+    if err: exit(str(err))
+    return lang, changes
+
+def generate(llp_fn: str, fn: str, debug: bool = False, use_cache: bool = True, optimized: bool = False, analyzed: bool = False) -> dict:
+    lang = load_optimized(llp_fn, use_cache, analyzed)[0] if optimized else load_language(llp_fn, use_cache, analyzed)
+    ast, err = llp.from_file(fn, lang, debug)
+    if err: exit(str(err))
+    return ast
+
+def check(llp_fn: str, fn: str, use_cache: bool = True, analyzed: bool = False) -> list:
+    # every syntax error of the file, parsing on past errors in layers with SYNC tokens
+    lang = load_language(llp_fn, use_cache, analyzed)
+    try:
+        with open(fn, "r") as f: text = f.read()
+    except FileNotFoundError: exit(f"file '{fn}' not found in cwd")
+    tokens, err = llp.lex(fn, text, lang.lexer)
+    if err: return [err]
+    _, errors = llp.parse_recover(tokens, lang.parser, lang.error)
+    return errors
+
+def profile(llp_fn: str, fn: str, memo: bool = False, use_cache: bool = True, optimized: bool = False, analyzed: bool = False) -> tuple:
+    # (profiler, err) of lexing and parsing the file, see src/profiler.py
+    lang = load_optimized(llp_fn, use_cache, analyzed)[0] if optimized else load_language(llp_fn, use_cache, analyzed)
+    try:
+        with open(fn, "r") as f: text = f.read()
+    except FileNotFoundError: exit(f"file '{fn}' not found in cwd")
+    prof = profiler.Profiler(lang.parser)
+    err = prof.lex(fn, text, lang.lexer)
+    if err: return prof, err
+    tokens, err = llp.lex(fn, text, lang.lexer)
+    if err: return prof, err
+    _, err = llp.parse(tokens, lang.parser, lang.error, memo=llp.Memo() if memo else None, tracer=prof)
+    return prof, err
+
+def compile_grammar(llp_fn: str, out_fn: str, use_cache: bool = True, optimized: bool = False, analyzed: bool = False):
+    lang = load_optimized(llp_fn, use_cache, analyzed)[0] if optimized else load_language(llp_fn, use_cache, analyzed)
+    with open(out_fn, "w") as f:
+        f.write(compiler.compile_language(lang, llp_fn))
+
+def run(interpreter, llp_fn: str, fn: str, debug: bool = False):
+    ast = generate(llp_fn, fn, debug)
+    math = interpreter()
+    out = math.enter(ast)
+    if out[-1]: exit(str(out[-1]))
+    if out[0] is not None: print(out[0])
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(prog="llp", description="language lexer and parser")
+    commands = args.add_subparsers(dest="command", required=True)
+    parse_args = commands.add_parser("parse", help="parse a file and print its ast")
+    parse_args.add_argument("grammar")
+    parse_args.add_argument("file")
+    parse_args.add_argument("--debug", action="store_true")
+    parse_args.add_argument("-O", "--optimize", action="store_true", help="run the optimizer pass on the grammar")
+    parse_args.add_argument("-A", "--analyze", action="store_true", help="check the grammar with the analyzer first")
+    check_args = commands.add_parser("check", help="report every syntax error of a file")
+    check_args.add_argument("grammar")
+    check_args.add_argument("file")
+    check_args.add_argument("-A", "--analyze", action="store_true", help="check the grammar with the analyzer first")
+    profile_args = commands.add_parser("profile", help="time the layers, alternatives and lexer rules of a parse")
+    profile_args.add_argument("grammar")
+    profile_args.add_argument("file")
+    profile_args.add_argument("--memo", action="store_true", help="parse with a packrat memo")
+    profile_args.add_argument("--collapsed", help="write collapsed layer stacks for flamegraphs to this file")
+    profile_args.add_argument("-O", "--optimize", action="store_true", help="run the optimizer pass on the grammar")
+    profile_args.add_argument("-A", "--analyze", action="store_true", help="check the grammar with the analyzer first")
+    compile_args = commands.add_parser("compile", help="compile a grammar to a standalone parser module")
+    compile_args.add_argument("grammar")
+    compile_args.add_argument("-o", "--output", required=True)
+    compile_args.add_argument("-O", "--optimize", action="store_true", help="run the optimizer pass on the grammar")
+    compile_args.add_argument("-A", "--analyze", action="store_true", help="check the grammar with the analyzer first")
+    optimize_args = commands.add_parser("optimize", help="list what the optimizer pass changes in a grammar")
+    optimize_args.add_argument("grammar")
+    analyze_args = commands.add_parser("analyze", help="report left recursion, loops, unreachable and backtracking alternatives of a grammar")
+    analyze_args.add_argument("grammar")
+    analyze_args.add_argument("--severity", choices=analyze.SEVERITIES, default=analyze.INFO, help="the least severe findings to report")
+    args = args.parse_args()
+    if args.command == "parse": print(generate(args.grammar, args.file, args.debug, optimized=args.optimize, analyzed=args.analyze))
+    if args.command == "check":
+        errors = check(args.grammar, args.file, analyzed=args.analyze)
+        for err in errors: print(err)
+        if errors: exit(1)
+    if args.command == "compile": compile_grammar(args.grammar, args.output, optimized=args.optimize, analyzed=args.analyze)
+    if args.command == "optimize":
+        for change in load_optimized(args.grammar)[1]: print(change)
+    if args.command == "analyze":
+        findings, err = analyze.analyze(load_language(args.grammar))
+        if err: exit(str(err))
+        limit = analyze.SEVERITIES.index(args.severity)
+        for f in findings:
+            if analyze.SEVERITIES.index(f.severity) <= limit: print(f)
+        if any(f.severity == analyze.ERROR for f in findings): exit(1)
+    if args.command == "profile":
+        prof, err = profile(args.grammar, args.file, args.memo, optimized=args.optimize, analyzed=args.analyze)
+        prof.report()
+        if args.collapsed:
+            with open(args.collapsed, "w") as f: prof.collapsed(f)
+        if err: exit(str(err))
\ No newline at end of file
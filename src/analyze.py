@@ -0,0 +1,151 @@
+import src.lexer as l
+import src.transform as t
+from src.optimize import same, describe
+
+# static checks of a transformed grammar for what makes the parser hang or backtrack. errors
+# are grammars llp.parse never finishes on, warnings alternatives that never match and infos
+# alternatives the parser may try and then backtrack out of
+ERROR, WARNING, INFO = "error", "warning", "info"
+SEVERITIES = (ERROR, WARNING, INFO)
+
+class Finding:
+    def __init__(self, severity: str, msg: str, start: l.Position, stop: l.Position):
+        self.severity, self.msg, self.start, self.stop = severity, msg, start, stop
+    def __str__(self):
+        return f"{self.severity}: {self.msg} (ln {self.start.ln}, col {self.start.col})"
+
+def alternatives(layer: t.Layer) -> list:
+    # the To alternatives of a layer in grammar order, also after optimize factored them
+    return [a for to in layer.patterns for a in (to.alternatives if isinstance(to, t.Factored) else [to]) if isinstance(a, t.To)]
+
+def left_calls(x, parser: t.Parser) -> tuple:
+    # (IDs x can call at the index it starts at, nullable)
+    if isinstance(x, t.ID): return [x], t.first(x, parser)[1]
+    if isinstance(x, t.Group):
+        calls, nullable = [], False
+        for e in x.group:
+            c, n = left_calls(e, parser)
+            calls += c
+            nullable = nullable or n
+        return calls, nullable
+    if isinstance(x, t.Repeat): return left_calls(x.node, parser)
+    if isinstance(x, t.Binary): return left_seq([x.left, x.op, x.right], parser)
+    return [], t.first(x, parser)[1]
+def left_seq(elements: list, parser: t.Parser) -> tuple:
+    calls = []
+    for e in elements:
+        c, n = left_calls(e, parser)
+        calls += c
+        if not n: return calls, False
+    return calls, True
+
+def left_recursion(parser: t.Parser, findings: list):
+    # a layer reaching itself again without consuming a token calls itself until python's
+    # recursion limit. edges[layer] are the (layer, ID) calls it makes at its start index
+    edges = {}
+    for layer in parser.layers:
+        calls = [c for to in alternatives(layer) for c in left_seq(to.pattern.pattern, parser)[0]]
+        if isinstance(layer.link_layer, t.ID): calls.append(layer.link_layer)
+        edges[layer] = [(c.target, c) for c in calls if c.target is not None]
+    reported = set()
+    for layer in parser.layers:
+        if layer in reported: continue
+        # the shortest path of calls back to the layer
+        paths, queue = {}, [layer]
+        for at in queue:
+            for target, ref in edges[at]:
+                if target in paths: continue
+                paths[target] = (at, ref)
+                queue.append(target)
+        if layer not in paths: continue
+        cycle, at = [], layer
+        while True:
+            at, ref = paths[at]
+            cycle.append(ref)
+            if at is layer: break
+        cycle.reverse()
+        reported.update(ref.target for ref in cycle)
+        name = layer.name.value
+        if len(cycle) == 1: msg = f"{name} is left recursive, it calls itself before consuming a token"
+        else: msg = f"{name} is indirectly left recursive through {' -> '.join([name, *(ref.value for ref in cycle)])}"
+        findings.append(Finding(ERROR, msg, cycle[0].start, cycle[0].stop))
+
+def no_progress(parser: t.Parser, findings: list):
+    # a repeat matches its body again as long as it matches, a body matching without consuming
+    # a token matches forever. the same goes for the operations of a binary
+    for layer in parser.layers:
+        for x in t.walk(layer):
+            if isinstance(x, t.Repeat) and t.first(x.node, parser)[1]:
+                findings.append(Finding(ERROR, f"{layer.name.value}: the body of {t.pattern_str(x)} can match without consuming a token, the repeat never ends", x.start, x.stop))
+            elif isinstance(x, t.Binary) and t.first_seq([x.op, x.right], parser)[1]:
+                findings.append(Finding(ERROR, f"{layer.name.value}: the operator and operand of {t.pattern_str(x)} can match without consuming a token, the binary never ends", x.start, x.stop))
+
+def key(e):
+    # elements that are the same have the same key
+    if isinstance(e, t.Token): return e.kind, e.value
+    if isinstance(e, t.ID): return id(e.target)
+    return type(e)
+
+def unreachable(parser: t.Parser, findings: list, lexer: t.Lexer) -> set:
+    # returns the alternatives that never match
+    dead = set()
+    for layer in parser.layers:
+        name, alts = layer.name.value, alternatives(layer)
+        # the live alternatives so far by the key of their first element, those without elements
+        # under None
+        starts = {}
+        for i, to in enumerate(alts):
+            pattern = to.pattern.pattern
+            # an alternative starting with the whole pattern of an earlier one is only tried when
+            # that pattern failed
+            candidates = sorted(starts.get(None, []) + (starts.get(key(pattern[0]), []) if pattern else []))
+            cover = next((j for j in candidates if len(alts[j].pattern.pattern) <= len(pattern)
+                          and all(map(same, alts[j].pattern.pattern, pattern))), None)
+            if cover is not None:
+                dead.add(to)
+                findings.append(Finding(WARNING, f"{name}: alternative {i+1} ({describe(to)}) never matches, alternative {cover+1} "
+                                                 f"({describe(alts[cover])}) matches whatever it would", to.start, to.stop))
+                continue
+            undefined = next((x for x in t.walk(to.pattern) if isinstance(x, t.Token) and x.kind < 0), None)
+            if undefined is not None and lexer:
+                dead.add(to)
+                findings.append(Finding(WARNING, f"{name}: alternative {i+1} ({describe(to)}) never matches, the lexer makes no {undefined.value[0]} tokens",
+                                        undefined.start, undefined.stop))
+                continue
+            starts.setdefault(key(pattern[0]) if pattern else None, []).append(i)
+        if layer.link_layer and any(not to.pattern.pattern for to in alts):
+            findings.append(Finding(WARNING, f"{name}: the link to {layer.link_layer} is never tried, an alternative without elements always matches",
+                                    layer.link_layer.start, layer.link_layer.stop))
+    return dead
+
+def overlaps(parser: t.Parser, findings: list, lexer: t.Lexer, dead: set):
+    # alternatives that can start with the same token are all tried on it in order, every one
+    # that fails part way is work the parser throws away
+    kind_name = lambda kind: f"[{lexer.kinds[kind].value}]" if lexer and 0 <= kind < len(lexer.kinds) else str(kind)
+    for layer in parser.layers:
+        alts = alternatives(layer)
+        firsts = [t.first_seq(to.pattern.pattern, parser) for to in alts]
+        # token kind -> the alternatives so far that can start with it
+        starts = {}
+        for i, to in enumerate(alts):
+            if to in dead or firsts[i][1] or t.ANY in firsts[i][0]: continue
+            earlier = sorted({j for kind in firsts[i][0] for j in starts.get(kind, ())})
+            for kind in firsts[i][0]: starts.setdefault(kind, []).append(i)
+            if not earlier: continue
+            kinds = sorted(set.union(*(firsts[j][0] for j in earlier)) & firsts[i][0])
+            shared = "the same first element" if all(same(alts[j].pattern.pattern[0], to.pattern.pattern[0]) for j in earlier) else "the same token"
+            findings.append(Finding(INFO, f"{layer.name.value}: alternative {i+1} ({describe(to)}) can start with {', '.join(map(kind_name, kinds))} "
+                                          f"like alternative{'s' * (len(earlier) > 1)} {', '.join(str(j+1) for j in earlier)}, "
+                                          f"the parser backtracks over {shared} to reach it", to.start, to.stop))
+
+def analyze(lang: t.Language) -> tuple:
+    # returns (findings, err), the findings ordered by severity and then position
+    findings = []
+    parser = lang.parser
+    if not parser: return findings, None
+    left_recursion(parser, findings)
+    no_progress(parser, findings)
+    dead = unreachable(parser, findings, lang.lexer)
+    overlaps(parser, findings, lang.lexer, dead)
+    findings.sort(key=lambda f: (SEVERITIES.index(f.severity), f.start.idx))
+    return findings, None
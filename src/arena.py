@@ -0,0 +1,100 @@
+from array import array
+from collections.abc import Mapping, Sequence
+from src.tokens import Tokens
+
+LIST = 0
+
+class Arena:
+    # flat AST store: node n has a shape id, the index of its first child ref in `children` and the
+    # token range it matched. a shape is (type, fields, base), base shapes extend the node or token
+    # their first child refers to. refs are n+1 for nodes and -(idx+1) for tokens, so they are never 0
+    def __init__(self, tokens: Tokens):
+        self.tokens = tokens
+        self.shapes, self.shape_ids = [(None, (), False)], {}
+        self.shape, self.first = array("i"), array("i")
+        self.start, self.stop = array("i"), array("i")
+        self.children = array("i")
+    def __len__(self):
+        return len(self.shape)
+    def shape_id(self, type: str, fields: tuple, base: bool = False) -> int:
+        key = (type, fields, base)
+        shape = self.shape_ids.get(key)
+        if shape is None:
+            shape = self.shape_ids[key] = len(self.shapes)
+            self.shapes.append(key)
+        return shape
+    def node(self, shape: int, refs, start: int, stop: int) -> int:
+        self.shape.append(shape)
+        self.first.append(len(self.children))
+        self.start.append(start)
+        self.stop.append(stop)
+        self.children.extend(refs)
+        return len(self.shape)
+    def end(self, n: int) -> int:
+        return self.first[n+1] if n+1 < len(self.first) else len(self.children)
+    def mark(self) -> tuple:
+        return len(self.shape), len(self.children)
+    def release(self, mark: tuple):
+        # drops the nodes made since mark, for matches that were backtracked over
+        nodes, children = mark
+        for column in (self.shape, self.first, self.start, self.stop): del column[nodes:]
+        del self.children[children:]
+    def view(self, ref: int):
+        if ref < 0: return self.tokens[-ref-1]
+        if self.shape[ref-1] == LIST: return ListView(self, ref-1)
+        return NodeView(self, ref-1)
+    def span(self, n: int) -> tuple:
+        # source offsets of the tokens node n matched, None without positions
+        last = min(self.stop[n], len(self.tokens)) - 1
+        start, stop = self.tokens.start_position(self.start[n]), self.tokens.stop_position(last)
+        if start is None: return None
+        return start.idx, stop.idx
+
+class NodeView(Mapping):
+    # dict-like view of one arena node, children are only wrapped in views when they are read
+    __slots__ = ("arena", "n")
+    def __init__(self, arena: Arena, n: int):
+        self.arena, self.n = arena, n
+    def __getitem__(self, key: str):
+        arena = self.arena
+        type, fields, base = arena.shapes[arena.shape[self.n]]
+        first = arena.first[self.n]
+        if key in fields: return arena.view(arena.children[first + base + fields.index(key)])
+        if base: return arena.view(arena.children[first])[key]
+        if key == "type": return type
+        raise KeyError(key)
+    def __iter__(self):
+        type, fields, base = self.arena.shapes[self.arena.shape[self.n]]
+        if not base: return iter(("type", *fields))
+        keys = list(self.arena.view(self.arena.children[self.arena.first[self.n]]))
+        return iter(keys + [k for k in fields if k not in keys])
+    def __len__(self):
+        return sum(1 for _ in self)
+    def __repr__(self):
+        return repr(dict(self))
+    def copy(self) -> dict:
+        return dict(self)
+    @property
+    def span(self) -> tuple:
+        return self.arena.span(self.n)
+    @property
+    def text(self) -> str:
+        span = self.span
+        return self.arena.tokens.file.text[span[0]:span[1]] if span else None
+
+class ListView(Sequence):
+    # the matches of a repetition
+    __slots__ = ("arena", "n")
+    def __init__(self, arena: Arena, n: int):
+        self.arena, self.n = arena, n
+    def __len__(self):
+        return self.arena.end(self.n) - self.arena.first[self.n]
+    def __getitem__(self, i: int):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError("list index out of range")
+        return self.arena.view(self.arena.children[self.arena.first[self.n] + i])
+    def __repr__(self):
+        return repr(list(self))
+    @property
+    def span(self) -> tuple:
+        return self.arena.span(self.n)
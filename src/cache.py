@@ -0,0 +1,38 @@
+import hashlib
+import os
+import pickle
+import src
+import src.transform as t
+
+# bump whenever the layout of the pickled transform.Language changes
+FORMAT = 13
+DIR = "__llpcache__"
+
+def key(text: str) -> bytes:
+    return hashlib.sha256(f"llp {src.__version__} format {FORMAT}\n{text}".encode()).hexdigest().encode()
+
+def path(llp_fn: str) -> str:
+    head, tail = os.path.split(llp_fn)
+    return os.path.join(head, DIR, tail + ".pickle")
+
+def load(llp_fn: str, text: str) -> t.Language:
+    try:
+        with open(path(llp_fn), "rb") as f: data = f.read()
+    except OSError: return None
+    k = key(text)
+    if not data.startswith(k + b"\n"): return None
+    try: lang = pickle.loads(memoryview(data)[len(k)+1:])
+    except Exception: return None
+    return lang if isinstance(lang, t.Language) else None
+
+def store(llp_fn: str, text: str, lang: t.Language):
+    fn = path(llp_fn)
+    tmp = f"{fn}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(key(text) + b"\n")
+            pickle.dump(lang, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, fn)
+    except (OSError, pickle.PicklingError, RecursionError):
+        if os.path.exists(tmp): os.remove(tmp)
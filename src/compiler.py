@@ -0,0 +1,320 @@
+import src
+import src.transform as t
+
+RUNTIME = r'''import re
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping
+
+class Kind:
+    __slots__ = ("value",)
+    def __init__(self, value: str):
+        self.value = value
+    def __str__(self):
+        return self.value
+    def __repr__(self):
+        return self.value
+
+class File:
+    def __init__(self, fn: str, text: str):
+        self.fn, self.text, self._newlines = fn, text, None
+    def newlines(self) -> array:
+        if self._newlines is None:
+            newlines, text = array("q"), self.text
+            i = text.find("\n")
+            while i >= 0:
+                newlines.append(i)
+                i = text.find("\n", i + 1)
+            self._newlines = newlines
+        return self._newlines
+    def line_col(self, idx: int) -> tuple:
+        newlines = self.newlines()
+        ln = bisect_right(newlines, idx)
+        return ln + 1, idx - newlines[ln-1] if ln else idx
+    def lines(self, first: int, last: int) -> str:
+        newlines = self.newlines()
+        first = max(first, 1)
+        if last < first or first - 1 > len(newlines): return ""
+        start = newlines[first-2] + 1 if first >= 2 else 0
+        stop = newlines[last-1] if last - 1 < len(newlines) else len(self.text)
+        return self.text[start:stop]
+class Position:
+    __slots__ = ("idx", "file")
+    def __init__(self, idx: int, file: File):
+        self.idx, self.file = idx, file
+    @property
+    def ln(self) -> int:
+        return self.file.line_col(self.idx)[0]
+    @property
+    def col(self) -> int:
+        return self.file.line_col(self.idx)[1]
+
+class Error:
+    def __init__(self, name: str, msg: str, start: Position, stop: Position):
+        self.name, self.msg, self.start, self.stop = name, msg, start, stop
+    def __str__(self):
+        return repr(self)
+    def __repr__(self):
+        if self.start is None: return f"{self.name}: {self.msg}"
+        return f"{self.name}: {self.msg} (ln {self.start.ln}, col {self.start.col})\n" + \
+        self.start.file.lines(self.start.ln, self.stop.ln)
+
+class Token(Mapping):
+    __slots__ = ("tokens", "idx")
+    def __init__(self, tokens, idx: int):
+        self.tokens, self.idx = tokens, idx
+    def __getitem__(self, key: str):
+        tokens, idx = self.tokens, self.idx
+        if key == "type": return KINDS[tokens.kind[idx]]
+        if key == "value": return tokens.file.text[tokens.start[idx]:tokens.stop[idx]] if VALUES[tokens.kind[idx]] else None
+        if key == "start": return Position(tokens.start[idx], tokens.file)
+        if key == "stop": return Position(tokens.stop[idx], tokens.file)
+        raise KeyError(key)
+    def __iter__(self):
+        return iter(("type", "value", "start", "stop"))
+    def __len__(self):
+        return 4
+    def __repr__(self):
+        return repr(dict(self))
+    def copy(self) -> dict:
+        return dict(self)
+class Tokens:
+    def __init__(self, file: File):
+        self.file, self.kind, self.start, self.stop = file, array("i"), array("q"), array("q")
+    def __len__(self):
+        return len(self.kind)
+    def __getitem__(self, idx: int) -> Token:
+        if idx < 0: idx += len(self.kind)
+        if not 0 <= idx < len(self.kind): raise IndexError("token index out of range")
+        return Token(self, idx)
+
+def lex(fn: str, text: str) -> Tokens:
+    file = File(fn, text)
+    tokens = Tokens(file)
+    kind, start, stop = tokens.kind.append, tokens.start.append, tokens.stop.append
+    i = 0
+    while i < len(text):
+        for pattern, k in RULES:
+            m = pattern.match(text, i)
+            if m and m.end() > i: break
+        else:
+            pos = Position(i, file)
+            return None, Error("character error", f"unrecognized characyer {repr(text[i])}", pos, pos)
+        if k is not None:
+            kind(k)
+            start(i)
+            stop(m.end())
+        i = m.end()
+    kind(0)
+    start(i)
+    stop(i)
+    return tokens, None
+
+def format_error(s: str, args: list) -> str:
+    out, i = "", 0
+    while i < len(s):
+        if s[i] == "%":
+            i += 1
+            if not s[i].isdigit():
+                out += "?"
+                i += 1
+                continue
+            out += str(args[int(s[i])-1]) if int(s[i])-1 < len(args) else "?"
+            i += 1
+        else:
+            out += s[i]
+            i += 1
+    return out
+'''
+
+FOOTER = '''
+def from_text(text: str, fn: str = "<text-input>"):
+    tokens, err = lex(fn, text)
+    if err: return None, err
+    return parse(tokens)
+
+def from_file(fn: str):
+    try:
+        with open(fn, "r") as f:
+            return from_text(f.read(), fn)
+    except FileNotFoundError as e:
+        return None, f"file '{fn}' not found in cwd"
+
+if __name__ == "__main__":
+    import sys
+    ast, err = from_file(sys.argv[1])
+    if err: exit(str(err))
+    print(ast)
+'''
+
+class Compiler:
+    # writes one closure per layer and per nested Group/Binary/Repeat into a parse() function,
+    # every matcher takes a token index and returns (match, err, index after)
+    def __init__(self, lang: t.Language):
+        self.lang = lang
+        self.layers = {layer.name.value: layer for layer in lang.parser.layers} if lang.parser else {}
+        self.names = {name: f"layer_{i}_{''.join(c if c.isalnum() else '_' for c in name)}" for i, name in enumerate(self.layers)}
+        self.elements = []
+        self.lines = []
+    def emit(self, indent: int, line: str):
+        self.lines.append("    " * indent + line)
+    def call(self, e) -> str:
+        # expression of the function matching e, nested elements get their own closure
+        if isinstance(e, t.ID):
+            if e.value in self.names: return self.names[e.value]
+            return f"undefined({repr(e.value)})"
+        if isinstance(e, t.Token): return f"token_{e.kind}" if e.kind >= 0 else "no_token"
+        name = f"element_{len(self.elements)}"
+        self.elements.append((name, e))
+        return name
+    def element(self, name: str, e):
+        self.emit(1, f"def {name}(i):")
+        self.emit(2, f"# {e}")
+        if isinstance(e, t.Group):
+            for x in e.group:
+                self.emit(2, f"m, err, i = {self.call(x)}(i)")
+                self.emit(2, "if err: return None, err, i")
+                self.emit(2, "if m: return m, None, i")
+            self.emit(2, "return False, None, i")
+        elif isinstance(e, t.Repeat):
+            f = self.call(e.node)
+            self.emit(2, f"m, err, i = {f}(i)")
+            self.emit(2, "if err: return None, err, i")
+            self.emit(2, "if not m: return False, None, i")
+            self.emit(2, "ms = [m]")
+            self.emit(2, "while True:")
+            self.emit(3, f"m, err, i = {f}(i)")
+            self.emit(3, "if err: return None, err, i")
+            self.emit(3, "if not m: break")
+            self.emit(3, "ms.append(m)")
+            self.emit(2, "return ms, None, i")
+        elif isinstance(e, t.Binary):
+            left, op, right = self.call(e.left), self.call(e.op), self.call(e.right)
+            # an optional binary gives back its first operand where a plain one fails
+            fail = "operand, None, after" if e.optional else "None, None, i"
+            self.emit(2, f"left, err, i = {left}(i)")
+            self.emit(2, "if err: return None, err, i")
+            self.emit(2, "if not left: return None, None, i")
+            if e.optional: self.emit(2, "operand, after = left, i")
+            self.emit(2, f"op, err, i = {op}(i)")
+            self.emit(2, "if err: return None, err, i")
+            self.emit(2, f"if not op: return {fail}")
+            self.emit(2, "while True:")
+            self.emit(3, f"right, err, i = {right}(i)")
+            self.emit(3, "if err: return None, err, i")
+            self.emit(3, f"if not right: return {fail}")
+            self.emit(3, 'left = {"type": "BinaryOperation", "left": left, "op": op, "right": right}')
+            self.emit(3, f"op, err, i = {op}(i)")
+            self.emit(3, "if err: return None, err, i")
+            self.emit(3, "if not op: break")
+            self.emit(2, "return left, None, i")
+        else:
+            self.emit(2, f"return None, Error('pattern match error', {repr(f'cannot match {e}')}, None, None), i")
+    def match_elements(self, indent: int, elements: list, first: int = 1) -> bool:
+        # matches elements into r{first}... at j, breaking out of the enclosing loop when one
+        # fails. False when one of them never matches
+        for n, e in enumerate(elements, first):
+            if isinstance(e, t.Token):
+                if e.kind < 0:
+                    self.emit(indent, "break")
+                    return False
+                self.emit(indent, f"if (K[j] if j < N else EOF) != {e.kind}: break")
+                self.emit(indent, f"r{n} = token(j)")
+                self.emit(indent, "j += 1")
+                continue
+            self.emit(indent, f"r{n}, err, j = {self.call(e)}(j)")
+            self.emit(indent, "if err: return None, err, j")
+            self.emit(indent, f"if not r{n}: break")
+        return True
+    def alternative(self, to: t.To, indent: int = 2, skip: int = 0, start: str = "i"):
+        # skip elements were matched already by a Factored, from start
+        self.emit(indent, f"while True:  # {to.pattern.pattern and ' '.join(str(e) for e in to.pattern.pattern)}")
+        indent += 1
+        self.emit(indent, f"j = {start}")
+        if not self.match_elements(indent, to.pattern.pattern[skip:], skip + 1): return
+        count, vars_ = len(to.pattern.pattern), to.node.vars
+        if any(v.value - 1 >= count for v in vars_.values()):
+            self.emit(indent, 'raise Exception("index error for patterns")')
+            return
+        if isinstance(to.node.name, t.Int):
+            if not 1 <= to.node.name.value <= count:
+                self.emit(indent, f"raise IndexError('pattern has no element {to.node.name.value}')")
+                return
+            self.emit(indent, f"node = dict(r{to.node.name.value})" if vars_ else f"node = r{to.node.name.value}")
+        else:
+            self.emit(indent, f"node = {{'type': {repr(to.node.name.value)}}}")
+        for k, v in vars_.items():
+            self.emit(indent, f"node[{repr(k)}] = r{v.value}")
+        self.emit(indent, "return node, None, j")
+    def factored(self, f: t.Factored):
+        self.emit(2, f"while True:  # {' '.join(str(e) for e in f.prefix)} ...")
+        self.emit(3, "j = i")
+        if self.match_elements(3, f.prefix):
+            self.emit(3, "after = j")
+            for to in f.alternatives: self.alternative(to, 3, len(f.prefix), "after")
+        self.emit(3, "break")
+    def layer(self, layer: t.Layer):
+        self.emit(1, f"def {self.names[layer.name.value]}(i):")
+        self.emit(2, f"# {layer.name}")
+        for to in layer.patterns:
+            if isinstance(to, t.To): self.alternative(to)
+            elif isinstance(to, t.Factored): self.factored(to)
+        link = layer.link_layer
+        if isinstance(link, t.ErrorCall): self.error_call(link)
+        elif link: self.emit(2, f"return {self.call(link)}(i)")
+        else: self.emit(2, "return False, None, i")
+    def error_call(self, call: t.ErrorCall):
+        error_def = call.target
+        if not error_def:
+            self.emit(2, f"return None, Error('id not defined error', {repr(str(call.name))}, None, None), i")
+            return
+        args = []
+        for arg in call.args:
+            if isinstance(arg, t.Var): args.append(f"var({repr(arg.value)}, i)")
+            elif isinstance(arg, t.String): args.append(repr(arg.value))
+            else: args.append(repr(str(arg)))
+        self.emit(2, f"return None, format_error({repr(error_def.str.value)}, [{', '.join(args)}]), i")
+    def compile(self, fn: str) -> str:
+        lexer = self.lang.lexer
+        self.lines = [f"# generated by llp {src.__version__} from {fn}, do not edit", RUNTIME]
+        self.emit(0, f"KINDS = [{', '.join(f'Kind({repr(kind.value)})' for kind in lexer.kinds)}]")
+        self.emit(0, f"VALUES = {repr(lexer.values)}")
+        self.emit(0, "RULES = [")
+        for pattern, kind in lexer.rules: self.emit(1, f"(re.compile({repr(pattern.pattern)}), {kind}),")
+        self.emit(0, "]")
+        self.emit(0, "")
+        self.emit(0, "def parse(tokens: Tokens):")
+        self.emit(1, "K, N, EOF, file = tokens.kind, len(tokens), tokens.kind[-1], tokens.file")
+        self.emit(1, "def token(i):")
+        self.emit(2, "return tokens[i if i < N else N-1]")
+        self.emit(1, "def var(name, i):")
+        self.emit(2, "tok = token(i)")
+        self.emit(2, 'if name == "file_name": return file.fn')
+        self.emit(2, 'if name == "token": return tok["type"]')
+        self.emit(2, 'if name == "start_ln": return tok["start"].ln')
+        self.emit(2, 'if name == "start_col": return tok["start"].col')
+        self.emit(2, 'return "?"')
+        self.emit(1, "def no_token(i):")
+        self.emit(2, "return False, None, i")
+        self.emit(1, "def undefined(name):")
+        self.emit(2, "return lambda i: (None, Error('id not defined error', name, None, None), i)")
+        for kind in range(len(lexer.kinds)):
+            self.emit(1, f"def token_{kind}(i):")
+            self.emit(2, f"return (token(i), None, i + 1) if (K[i] if i < N else EOF) == {kind} else (False, None, i)")
+        for layer in self.layers.values(): self.layer(layer)
+        done = 0
+        while done < len(self.elements):
+            name, e = self.elements[done]
+            self.element(name, e)
+            done += 1
+        start = self.lang.parser.start_layer if self.lang.parser else None
+        if start is None: self.emit(1, "return None, Error('error', 'no parser defined', None, None)")
+        else:
+            self.emit(1, f"match, err, _ = {self.call(start)}(0)")
+            self.emit(1, "return match, err")
+        self.lines.append(FOOTER)
+        return "\n".join(self.lines)
+
+def compile_language(lang: t.Language, fn: str) -> str:
+    # source of a standalone lexer and recursive descent parser module for lang
+    return Compiler(lang).compile(fn)
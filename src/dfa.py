@@ -0,0 +1,230 @@
+from array import array
+import re
+from src.transform import sre_parse, first_codes
+
+# the lexer rules combined into one table driven DFA. the characters are split into classes that
+# every rule treats alike: each code the rules name explicitly, ASCII included, is kept apart and
+# any other character is grouped by whether it is a digit, word or space character. rules using
+# regex features a DFA can't run (anchors, lookarounds, backreferences, case folding, ...) are
+# left out of the DFA and matched with their regex next to it
+
+# DFA states before the rules are all matched with their regexes
+LIMIT = 20000
+# largest repeat count and non-ASCII range expanded into the DFA
+COUNT, RANGE = 64, 256
+CHAR, SPLIT, MATCH = 0, 1, 2
+CATEGORIES = {sre_parse.CATEGORY_DIGIT: (0, False), sre_parse.CATEGORY_NOT_DIGIT: (0, True),
+              sre_parse.CATEGORY_WORD: (1, False), sre_parse.CATEGORY_NOT_WORD: (1, True),
+              sre_parse.CATEGORY_SPACE: (2, False), sre_parse.CATEGORY_NOT_SPACE: (2, True)}
+
+class Unsupported(Exception): pass
+
+def signature(code: int, ascii: bool = False) -> tuple:
+    # (digit, word, space) of a character as \d, \w and \s see it
+    ch = chr(code)
+    if ascii:
+        if code >= 128: return False, False, False
+        return ch.isdigit(), ch.isalnum() or ch == "_", ch in " \t\n\r\f\v"
+    return ch.isdecimal(), ch.isalnum() or ch == "_", ch.isspace()
+
+class Classes(dict):
+    # str.translate table from character codes to class ids, the characters not named by any rule
+    # are looked up by signature when they are first seen
+    def __init__(self, codes: dict, others: dict):
+        super().__init__(codes)
+        self.others = others
+    def __missing__(self, code: int) -> int:
+        cls = self[code] = self.others[signature(code)]
+        return cls
+
+class DFA:
+    def __init__(self, longest: bool, classes: Classes, ncls: int, trans: array, accept: array, kinds: list, fallback: list):
+        # trans[state * ncls + class] is the next state or -1, accept[state] the rule a token
+        # ending in the state matches or -1. fallback are (rule, first codes, pattern) of the
+        # rules matched by regex, in rule order
+        self.longest, self.classes, self.ncls = longest, classes, ncls
+        self.trans, self.accept, self.kinds, self.fallback = trans, accept, kinds, fallback
+        # per state the bytes pattern that skips over the classes looping back to it
+        self.skip = []
+        for s in range(len(accept)):
+            row = trans[s * ncls:(s + 1) * ncls]
+            loop = bytes(c for c in range(ncls) if row[c] == s)
+            self.skip.append(re.compile(b"[" + re.escape(loop) + b"]*") if loop else None)
+    def __len__(self):
+        return len(self.accept)
+
+class Charsets:
+    # the character sets the parsed rules consume, (items, negate, flags) each
+    def __init__(self):
+        self.sets, self.codes = [], set(range(128))
+    def add(self, items: list, negate: bool, flags: int) -> tuple:
+        for item, arg in items:
+            if item is sre_parse.LITERAL: self.codes.add(arg)
+            elif item is sre_parse.RANGE:
+                if arg[1] >= 128:
+                    if arg[1] - max(arg[0], 128) >= RANGE: raise Unsupported()
+                    self.codes.update(range(max(arg[0], 128), arg[1] + 1))
+            elif item is sre_parse.CATEGORY:
+                if arg not in CATEGORIES: raise Unsupported()
+            elif item is not sre_parse.ANY: raise Unsupported()
+        self.sets.append((items, negate, flags))
+        return ("set", len(self.sets) - 1)
+    def member(self, k: int, code: int, sig: tuple) -> bool:
+        # whether set k has the character code, or any character of signature sig for None
+        items, negate, flags = self.sets[k]
+        if code is not None: sig = signature(code, flags & re.ASCII)
+        elif flags & re.ASCII: sig = (False, False, False)
+        for item, arg in items:
+            if item is sre_parse.LITERAL: hit = code == arg
+            elif item is sre_parse.RANGE: hit = code is not None and arg[0] <= code <= arg[1]
+            elif item is sre_parse.ANY: hit = code != 10 or flags & re.DOTALL
+            else:
+                which, negated = CATEGORIES[arg]
+                hit = sig[which] != negated
+            if hit: return not negate
+        return negate
+
+def tree(parsed, sets: Charsets, flags: int) -> tuple:
+    # the parsed regex as ("cat", nodes), ("alt", nodes), ("rep", min, max, greedy, node) and
+    # ("set", k) nodes, raises Unsupported for what the DFA can't run
+    nodes = []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL: nodes.append(sets.add([(op, av)], False, flags))
+        elif op is sre_parse.NOT_LITERAL: nodes.append(sets.add([(sre_parse.LITERAL, av)], True, flags))
+        elif op is sre_parse.ANY: nodes.append(sets.add([(op, None)], False, flags))
+        elif op is sre_parse.IN:
+            negate = bool(av) and av[0][0] is sre_parse.NEGATE
+            nodes.append(sets.add(av[1:] if negate else av, negate, flags))
+        elif op is sre_parse.BRANCH: nodes.append(("alt", [tree(branch, sets, flags) for branch in av[1]]))
+        elif op is sre_parse.SUBPATTERN:
+            if av[1] or av[2]: raise Unsupported()
+            nodes.append(tree(av[3], sets, flags))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            least, most, body = av
+            if least > COUNT or most != sre_parse.MAXREPEAT and most > COUNT: raise Unsupported()
+            # a repeat of a body matching the empty string stops early in the regex engine
+            if nullable(body): raise Unsupported()
+            nodes.append(("rep", least, None if most == sre_parse.MAXREPEAT else most, op is sre_parse.MAX_REPEAT, tree(body, sets, flags)))
+        else: raise Unsupported()
+    return ("cat", nodes)
+
+def nullable(parsed) -> bool:
+    for op, av in parsed:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN): return False
+        if op is sre_parse.BRANCH:
+            if not any(nullable(branch) for branch in av[1]): return False
+        elif op is sre_parse.SUBPATTERN:
+            if not nullable(av[3]): return False
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if av[0] and not nullable(av[2]): return False
+    return True
+
+class NFA:
+    # states of all rules: CHAR states consume a class of arg and go to next, SPLIT states go to
+    # the states in arg, first one first, MATCH states end rule arg
+    def __init__(self):
+        self.kind, self.arg, self.next = [], [], []
+    def add(self, kind: int, arg, next: int = -1) -> int:
+        self.kind.append(kind)
+        self.arg.append(arg)
+        self.next.append(next)
+        return len(self.kind) - 1
+    def build(self, node: tuple, next: int, classes: list) -> int:
+        # the state starting node, continuing with next
+        if node[0] == "set": return self.add(CHAR, classes[node[1]], next)
+        if node[0] == "cat":
+            for child in reversed(node[1]): next = self.build(child, next, classes)
+            return next
+        if node[0] == "alt": return self.add(SPLIT, [self.build(child, next, classes) for child in node[1]])
+        _, least, most, greedy, body = node
+        order = (lambda more: [more, next]) if greedy else (lambda more: [next, more])
+        if most is None:
+            loop = self.add(SPLIT, None)
+            self.arg[loop] = order(self.build(body, loop, classes))
+            state = loop
+        else:
+            state = next
+            for _ in range(most - least): state = self.add(SPLIT, order(self.build(body, state, classes)))
+        for _ in range(least): state = self.build(body, state, classes)
+        return state
+    def closure(self, states) -> list:
+        # the CHAR and MATCH states reached from states without consuming, in priority order
+        out, seen = [], set()
+        for state in states:
+            stack = [state]
+            while stack:
+                s = stack.pop()
+                if s in seen: continue
+                seen.add(s)
+                if self.kind[s] == SPLIT: stack.extend(reversed(self.arg[s]))
+                else: out.append(s)
+        return out
+
+def build(rules: list, longest: bool = False) -> DFA:
+    # the DFA of the (pattern, kind) rules of a lexer. the first rule that matches wins like in
+    # llp.lex, or with longest the rule that matches the most text and the first of those
+    sets, trees, fallback = Charsets(), [], []
+    for i, (pattern, kind) in enumerate(rules):
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+        flags = parsed.state.flags if hasattr(parsed, "state") else parsed.pattern.flags
+        size = len(sets.sets)
+        try:
+            if flags & (re.IGNORECASE | re.LOCALE): raise Unsupported()
+            trees.append((i, tree(parsed, sets, flags)))
+        except Unsupported:
+            del sets.sets[size:]
+            codes, _ = (None, False) if flags & re.IGNORECASE else first_codes(parsed)
+            fallback.append((i, None if codes is None else frozenset(map(chr, codes)), pattern))
+    dfa = construct(rules, sets, trees, fallback, longest)
+    if dfa is None:
+        fallback = [(i, None, pattern) for i, (pattern, _) in enumerate(rules)]
+        dfa = construct(rules, Charsets(), [], fallback, longest)
+    return dfa
+
+def construct(rules: list, sets: Charsets, trees: list, fallback: list, longest: bool) -> DFA:
+    # the classes are the distinct rows of set membership
+    rows, codes, others = {}, {}, {}
+    members = lambda code, sig: tuple(sets.member(k, code, sig) for k in range(len(sets.sets)))
+    for code in sorted(sets.codes): codes[code] = rows.setdefault(members(code, None), len(rows))
+    for sig in ((a, b, c) for a in (False, True) for b in (False, True) for c in (False, True)):
+        others[sig] = rows.setdefault(members(None, sig), len(rows))
+    ncls = len(rows)
+    if ncls > 256: return None
+    classes = [frozenset(cls for row, cls in rows.items() if row[k]) for k in range(len(sets.sets))]
+    nfa, starts = NFA(), []
+    for i, node in trees: starts.append(nfa.build(node, nfa.add(MATCH, i), classes))
+    if longest:
+        def state(threads: list) -> tuple:
+            accept = min((nfa.arg[s] for s in threads if nfa.kind[s] == MATCH), default=-1)
+            return tuple(sorted(s for s in threads if nfa.kind[s] == CHAR)), accept
+        start = (tuple(sorted(s for s in nfa.closure(starts) if nfa.kind[s] == CHAR)), -1)
+    else:
+        # the threads in priority order, the first one to reach a MATCH cuts off the ones behind it
+        def state(threads: list) -> tuple:
+            for n, s in enumerate(threads):
+                if nfa.kind[s] == MATCH: return tuple(threads[:n]), nfa.arg[s]
+            return tuple(threads), -1
+        # a rule matching the empty string only cuts off its own threads, empty tokens don't count
+        start = []
+        for s in starts:
+            threads = nfa.closure([s])
+            start += state(threads)[0]
+        start = (tuple(start), -1)
+    ids, order = {start: 0}, [start]
+    trans, accept = array("i"), array("i")
+    for threads, rule in order:
+        accept.append(rule)
+        moves = [[] for _ in range(ncls)]
+        for s in threads:
+            for cls in nfa.arg[s]: moves[cls].append(nfa.next[s])
+        for targets in moves:
+            key = state(nfa.closure(targets)) if targets else ((), -1)
+            if key == ((), -1):
+                trans.append(-1)
+                continue
+            if key not in ids:
+                if len(order) >= LIMIT: return None
+                ids[key] = len(order)
+                order.append(key)
+            trans.append(ids[key])
+    return DFA(longest, Classes(codes, others), ncls, trans, accept, [kind for _, kind in rules], fallback)
@@ -1,20 +1,62 @@
 import re
+from array import array
+from bisect import bisect_left, bisect_right
 from enum import Enum, auto
 
 class File:
     def __init__(self, fn: str, text: str):
         self.fn = fn
         self.text = text
+        self._newlines = None
     def copy(self):
         return File(self.fn, self.text)
+    def newlines(self) -> array:
+        # offsets of every newline, built once on the first line/column lookup
+        if self._newlines is None:
+            newlines, text = array("q"), self.text
+            nl = "\n" if isinstance(text, str) else b"\n"
+            i = text.find(nl)
+            while i >= 0:
+                newlines.append(i)
+                i = text.find(nl, i + 1)
+            self._newlines = newlines
+        return self._newlines
+    def line_col(self, idx: int) -> tuple:
+        # a newline starts the line it leads into at col 0
+        newlines = self.newlines()
+        ln = bisect_right(newlines, idx)
+        return ln + 1, idx - newlines[ln-1] if ln else idx
+    def lines(self, first: int, last: int) -> str:
+        # same as "\n".join(text.split("\n")[first-1:last]) without splitting the whole text
+        newlines = self.newlines()
+        first = max(first, 1)
+        if last < first or first - 1 > len(newlines): return ""
+        start = newlines[first-2] + 1 if first >= 2 else 0
+        stop = newlines[last-1] if last - 1 < len(newlines) else len(self.text)
+        text = self.text[start:stop]
+        return text if isinstance(text, str) else text.decode("utf-8", "replace")
+    def position(self, idx: int):
+        return Position(idx, self)
+    def edit(self, offset: int, removed: int, inserted: str):
+        # the file after replacing `removed` characters at offset, reusing the newline index
+        file = File(self.fn, self.text[:offset] + inserted + self.text[offset+removed:])
+        if self._newlines is not None:
+            newlines, shift = self._newlines, len(inserted) - removed
+            a, b = bisect_left(newlines, offset), bisect_left(newlines, offset + removed)
+            added, i = array("q"), inserted.find("\n")
+            while i >= 0:
+                added.append(offset + i)
+                i = inserted.find("\n", i + 1)
+            file._newlines = newlines[:a] + added + array("q", map(shift.__add__, newlines[b:]))
+        return file
 class Position:
-    def __init__(self, idx: int, ln: int, col: int, file: File):
+    def __init__(self, idx: int, file: File, ln: int = None, col: int = None):
+        # line and column are looked up from the file when first read unless given
         self._idx = idx
-        self.ln = ln
-        self.col = col
         self.file = file
+        self._ln_col = (ln, col) if ln is not None else None
     def copy(self):
-        return Position(self._idx, self.ln, self.col, self.file)
+        return Position(self._idx, self.file, *(self._ln_col or ()))
     @property
     def idx(self) -> int:
         return self._idx
@@ -22,13 +64,17 @@ class Position:
     def idx(self, v: int):
         if 0 <= v <= len(self.file.text):
             self._idx = v
+            self._ln_col = None
+    @property
+    def ln(self) -> int:
+        if self._ln_col is None: self._ln_col = self.file.line_col(self._idx)
+        return self._ln_col[0]
+    @property
+    def col(self) -> int:
+        if self._ln_col is None: self._ln_col = self.file.line_col(self._idx)
+        return self._ln_col[1]
     def advance(self, steps: int = 1):
         self.idx += steps
-        self.col += steps
-        if self.idx < len(self.file.text):
-            if self.file.text[self.idx] == "\n":
-                self.col = 0
-                self.ln += 1
     def next(self) -> str:
         char = self.char()
         self.advance()
@@ -55,7 +101,7 @@ class Token:
 
 keywords = [
     "NAME", "EXTENTION", "LEXER", "PARSER", "TRUE", "IGNORE", "VALUE", "DELIM", "LAYER", "EXPECT", "ERROR", "BINARY",
-    "REPEAT"
+    "REPEAT", "SYNC"
 ]
 class T(Enum):
     EOF = auto()
@@ -85,152 +131,61 @@ class T(Enum):
     EXPECT = auto()
     ERROR = auto()
     BINARY = auto()
+    SYNC = auto()
+
+# the token patterns in the order the lexer tries them, as one anchored pattern. names may not be
+# followed by other word characters, also non-ASCII ones
+PATTERN = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in [
+    ("var", r"@[a-zA-Z_][a-zA-Z_0-9]+\b"),
+    ("to", r"->"),
+    ("token", r"\[\w+(?::\w+)?\]"),
+    ("name", r"[a-zA-Z_][a-zA-Z_0-9]+\b"),
+    ("float", r"\d+\.\d+|\.\d+|\d+\."),
+    ("int", r"\d+"),
+    ("str", r'"[^"]*"|\'[^\']*\''),
+]))
+# single character tokens, their stop is their start
+chars = {"\n": T.NL, "{": T.BODY_IN, "}": T.BODY_OUT, "(": T.GROUP_IN, ")": T.GROUP_OUT, "=": T.EQ, "*": T.REPEAT}
+keyword_types = {keyword: T[keyword] for keyword in keywords}
 
 class Lexer:
     def __init__(self, fn, text):
-        self.pos, self.tokens = Position(-1, 1, -1, File(fn, text)), []
-        self.pos.advance()
-    def match(self, pattern: str):
-        match = re.search(pattern, self.pos.sub())
-        if match:
-            return match.string[match.start():match.end()] \
-                if self.pos.sub().startswith(match.string[match.start():match.end()]) else None
-    def name(self):
-        match = self.match(r"\b[a-zA-Z_]([a-zA-Z_0-9])+\b")
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            if match in keywords:
-                self.tokens.append(Token(T.__dict__[match], None, start, self.pos.copy()))
-                return True
-            self.tokens.append(Token(T.ID, match, start, self.pos.copy()))
-            return True
-        return False
-    def var(self):
-        match = self.match(r"@[a-zA-Z_]([a-zA-Z_0-9])+\b")
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            if match in keywords:
-                self.tokens.append(Token(T.__dict__[match], None, start, self.pos.copy()))
-                return True
-            self.tokens.append(Token(T.VAR, match[1:], start, self.pos.copy()))
-            return True
-        return False
-    def int(self):
-        match = self.match(r"\d+")
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            self.tokens.append(Token(T.INT, int(match), start, self.pos.copy()))
-            return True
-        return False
-    def float(self):
-        match = self.match(r"\d+\.\d+")
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            self.tokens.append(Token(T.FLOAT, float(match), start, self.pos.copy()))
-            return True
-        match = self.match(r"\.\d+")
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            self.tokens.append(Token(T.FLOAT, float(match), start, self.pos.copy()))
-            return True
-        match = self.match(r"\d+\.")
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            self.tokens.append(Token(T.FLOAT, float(match), start, self.pos.copy()))
-            return True
-        return False
-    def str(self):
-        match = self.match(r'"[^"]*"')
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            match = match[1:-1]
-            match = match.replace("\\t", "\t").replace("\\n", "\n")
-            self.tokens.append(Token(T.STR, match, start, self.pos.copy()))
-            return True
-        match = self.match(r"'[^']*'")
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            match = match[1:-1]
-            match = match.replace("\\t", "\t").replace("\\n", "\n")
-            self.tokens.append(Token(T.STR, match, start, self.pos.copy()))
-            return True
-        return False
-    def token(self):
-        match = self.match(r'\[\w+:\w+\]')
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            match = match[1:-1].split(":")
-            type_, value = match[0], match[1]
-            self.tokens.append(Token(T.TOKEN, (type_, value), start, self.pos.copy()))
-            return True
-        match = self.match(r'\[\w+\]')
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            match = match[1:-1]
-            self.tokens.append(Token(T.TOKEN, (match,), start, self.pos.copy()))
-            return True
-        return False
-    def to(self):
-        match = self.match(r"->")
-        if match:
-            start = self.pos.copy()
-            self.pos.advance(len(match))
-            self.tokens.append(Token(T.TO, None, start, self.pos.copy()))
-            return True
-        return False
+        self.pos, self.tokens = Position(0, File(fn, text)), []
     def lex(self):
-        while self.pos.char() is not None:
-            if self.pos.char() in [" ", "\t"]:
-                self.pos.advance()
-                continue
-            if self.pos.char() == "\n":
-                self.tokens.append(Token(T.NL, None, self.pos.copy(), self.pos.copy()))
-                self.pos.advance()
-                continue
-            if self.pos.char() == "{":
-                self.tokens.append(Token(T.BODY_IN, None, self.pos.copy(), self.pos.copy()))
-                self.pos.advance()
-                continue
-            if self.pos.char() == "}":
-                self.tokens.append(Token(T.BODY_OUT, None, self.pos.copy(), self.pos.copy()))
-                self.pos.advance()
-                continue
-            if self.pos.char() == "(":
-                self.tokens.append(Token(T.GROUP_IN, None, self.pos.copy(), self.pos.copy()))
-                self.pos.advance()
-                continue
-            if self.pos.char() == ")":
-                self.tokens.append(Token(T.GROUP_OUT, None, self.pos.copy(), self.pos.copy()))
-                self.pos.advance()
+        # one pass over the text, characters nothing matches are skipped
+        file, tokens = self.pos.file, self.tokens
+        text, i = file.text, self.pos.idx
+        match, append, n = PATTERN.match, tokens.append, len(text)
+        while i < n:
+            char = text[i]
+            if char == " " or char == "\t":
+                i += 1
                 continue
-            if self.pos.char() == "=":
-                self.tokens.append(Token(T.EQ, None, self.pos.copy(), self.pos.copy()))
-                self.pos.advance()
+            t = chars.get(char)
+            if t is not None:
+                append(Token(t, None, Position(i, file), Position(i, file)))
+                i += 1
                 continue
-            if self.pos.char() == "*":
-                self.tokens.append(Token(T.REPEAT, None, self.pos.copy(), self.pos.copy()))
-                self.pos.advance()
+            m = match(text, i)
+            if m is None:
+                i += 1
                 continue
-            if self.var(): continue
-            if self.to(): continue
-            if self.token(): continue
-            if self.name(): continue
-            if self.float(): continue
-            if self.int(): continue
-            if self.str(): continue
-            self.pos.advance()
-        self.tokens.append(Token(T.EOF, None, self.pos.copy(), self.pos.copy()))
-        return self.tokens, None
+            kind, value, end = m.lastgroup, m.group(), m.end()
+            if kind == "name":
+                t = keyword_types.get(value)
+                if t is None: t = T.ID
+                else: value = None
+            elif kind == "var": t, value = T.VAR, value[1:]
+            elif kind == "token": t, value = T.TOKEN, tuple(value[1:-1].split(":"))
+            elif kind == "float": t, value = T.FLOAT, float(value)
+            elif kind == "int": t, value = T.INT, int(value)
+            elif kind == "str": t, value = T.STR, value[1:-1].replace("\\t", "\t").replace("\\n", "\n")
+            else: t, value = T.TO, None
+            append(Token(t, value, Position(i, file), Position(end, file)))
+            i = end
+        self.pos = Position(i, file)
+        append(Token(T.EOF, None, self.pos.copy(), self.pos.copy()))
+        return tokens, None
 
 def tokenize(fn, text):
     lexer = Lexer(fn, text)
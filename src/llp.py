@@ -1,6 +1,11 @@
-from src.lexer import File, Position, Token
+from array import array
+from collections.abc import Mapping
+import io, mmap, os, pickle
+from src.lexer import File, Position
+from src.tokens import TokenView, Tokens, BareTokens, ByteTokens, EditTokens
+from src.arena import LIST, Arena
+from src import dfa
 import src.transform as t
-import re
 
 class Error:
     def __init__(self, msg: str, start: Position, stop: Position):
@@ -8,8 +13,9 @@ class Error:
     def __str__(self):
         return repr(self)
     def __repr__(self):
+        if self.start is None: return f"{self.name}: {self.msg}"
         return f"{self.name}: {self.msg} (ln {self.start.ln}, col {self.start.col})\n" + \
-        "\n".join(self.start.file.text.split("\n")[self.start.ln-1:self.stop.ln])
+        self.start.file.lines(self.start.ln, self.stop.ln)
 class MatchError(Error):
     def __init__(self, msg: str, pattern: str, start: Position, stop: Position):
         super().__init__(f"{msg} ('{pattern}')", start, stop)
@@ -23,117 +29,379 @@ class PatternMatchError(Error):
         super().__init__(f"cannot match {e}", e.start, e.stop)
         self.name = "pattern match error"
 class CharacterError(Error):
-    def __init__(self, pos: Position):
-        super().__init__(f"unrecognized characyer {repr(pos.char())}", pos, pos)
+    def __init__(self, pos: Position, char: str = None):
+        super().__init__(f"unrecognized characyer {repr(pos.char() if char is None else char)}", pos, pos)
         self.name = "character error"
 
+class DepthError(Error):
+    def __init__(self, depth: int, start: Position, stop: Position):
+        super().__init__(f"input nested deeper than {depth} layer calls", start, stop)
+        self.name = "depth error"
+
 class LangError:
     def __init__(self, msg: str, start: Position, stop: Position):
         self.name, self.msg, self.start, self.stop = "error", msg, start, stop
     def __str__(self):
         return repr(self)
     def __repr__(self):
+        if self.start is None: return f"{self.name}: {self.msg}"
         return f"{self.start.file.fn}\n" + \
                f"{self.name}: {self.msg} (ln {self.start.ln}, col {self.start.col})\n" + \
-               "\n".join(self.start.file.text.split("\n")[self.start.ln-1:self.stop.ln])
+               self.start.file.lines(self.start.ln, self.stop.ln)
 class UnexpectedError(LangError):
     def __init__(self, token: dict):
         super().__init__(f"unexpected {token['type']}", token["start"], token["stop"])
         self.name = "syntax error"
 
+class Memo:
+    def __init__(self, limit: int = None, window: int = None):
+        # limit caps the number of entries, window drops entries that start more than
+        # `window` tokens behind the furthest position stored so far
+        self.limit, self.window = limit, window
+        self.rows = {}
+        self.size, self.low = 0, 0
+        self.hits, self.misses = 0, 0
+    def __repr__(self):
+        return f"<memo {self.size} entries, {self.hits} hits, {self.misses} misses>"
+    def get(self, layer, idx: int):
+        row = self.rows.get(idx)
+        if row is not None and layer in row:
+            self.hits += 1
+            return row[layer]
+        self.misses += 1
+        return None
+    def put(self, layer, idx: int, entry: tuple):
+        row = self.rows.get(idx)
+        if row is None: row = self.rows[idx] = {}
+        if layer not in row: self.size += 1
+        row[layer] = entry
+        if self.window is not None:
+            while self.low < idx - self.window:
+                self.size -= len(self.rows.pop(self.low, ()))
+                self.low += 1
+        if self.limit is not None:
+            while self.size > self.limit and self.rows:
+                self.size -= len(self.rows.pop(next(iter(self.rows))))
+
+class Tracer:
+    # receives parse events when passed to parse, every hook is a no-op here
+    def begin(self, tokens): pass
+    def enter(self, what: str, x, idx: int): pass
+    def exit(self, what: str, x, idx: int, match, err): pass
+    def token(self, tok: t.Token, idx: int, matched: bool): pass
+    def backtrack(self, to: t.To, start: int, idx: int): pass
+    def error(self, call: t.ErrorCall, err, idx: int): pass
+class PrintTracer(Tracer):
+    def __init__(self, out=None):
+        self.out = out
+        self.indent = 0
+        self.tokens = None
+    def begin(self, tokens):
+        self.tokens = tokens
+    def token_str(self, idx: int) -> str:
+        try: t = self.tokens[idx]
+        except IndexError: t = self.tokens[len(self.tokens)-1]
+        return f"[{t['type']}{':'+t['value'] if t['value'] is not None else ''}]"
+    def print(self, idx: int, s: str):
+        print(f"{' '*self.indent}{idx}{self.token_str(idx)} {s}", file=self.out)
+    def enter(self, what: str, x, idx: int):
+        if isinstance(x, t.To): x = x.pattern.pattern
+        self.print(idx, f"-> {what} {x}")
+        self.indent += 1
+    def exit(self, what: str, x, idx: int, match, err):
+        if isinstance(x, t.To): x = x.pattern.pattern
+        self.indent -= 1
+        result = match["type"] if isinstance(match, Mapping) else len(match) if type(match) is list else match
+        self.print(idx, f"<- {what} {x} ({result}{', error' if err else ''})")
+    def token(self, tok: t.Token, idx: int, matched: bool):
+        self.print(idx, f"   token {tok} ({matched})")
+    def backtrack(self, to: t.To, start: int, idx: int):
+        if idx > start: self.print(idx, f"   backtrack {idx - start} tokens to {start}")
+    def error(self, call: t.ErrorCall, err, idx: int):
+        self.print(idx, f"   error {err}")
+
+class EditMemo(Memo):
+    # packrat memo that outlives edits of an EditTokens store. rows from token index `gap` on
+    # are kept in `after`, keyed relative to the token count `n`, so an edit only moves the rows
+    # between it and the previous edit. entries remember how far they read, and the index range
+    # of each edit is kept in `edits` to drop entries that read into it when they are next used.
+    # after sweep_every edits, sweep drops all of them at once and clears the list. unlike Memo
+    # the number of entries isn't capped
+    def __init__(self, n: int, sweep_every: int = 256):
+        super().__init__()
+        self.n, self.gap = n, n
+        self.after = {}
+        self.gen, self.edits, self.sweep_every = 0, [], sweep_every
+    def row(self, idx: int, create: bool = False):
+        rows, key = (self.rows, idx) if idx < self.gap else (self.after, idx - self.n)
+        row = rows.get(key)
+        if row is None and create: row = rows[key] = {}
+        return row
+    def get(self, layer, idx: int):
+        row = self.row(idx)
+        entry = row.get(layer) if row is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        match, err, length, reach, gen = entry
+        if gen != self.gen:
+            for edit_gen, lo, hi in reversed(self.edits):
+                if edit_gen < gen: break
+                if idx < lo <= idx + reach:
+                    del row[layer]
+                    self.size -= 1
+                    self.misses += 1
+                    return None
+            row[layer] = (match, err, length, reach, self.gen)
+        self.hits += 1
+        return match, err, idx + length, idx + reach
+    def put(self, layer, idx: int, entry: tuple):
+        match, err, end, far = entry
+        # errors are formatted with positions that edits before them would shift
+        if err: return
+        row = self.row(idx, True)
+        if layer not in row: self.size += 1
+        row[layer] = (match, err, end - idx, far - idx, self.gen)
+    def move_gap(self, gap: int):
+        n = self.n
+        for idx in range(gap, self.gap):
+            row = self.rows.pop(idx, None)
+            if row is not None: self.after[idx - n] = row
+        for idx in range(self.gap, gap):
+            row = self.after.pop(idx - n, None)
+            if row is not None: self.rows[idx] = row
+        self.gap = gap
+    def edit(self, first: int, old_end: int, new_end: int):
+        # the tokens [first, old_end) were replaced by [first, new_end)
+        self.move_gap(old_end)
+        for idx in range(first, old_end):
+            self.size -= len(self.rows.pop(idx, ()))
+        shift = new_end - old_end
+        self.n, self.gap = self.n + shift, new_end
+        for edit in self.edits:
+            if edit[1] >= old_end: edit[1], edit[2] = edit[1] + shift, edit[2] + shift
+            elif edit[2] > first: edit[1], edit[2] = min(edit[1], first), max(new_end, edit[2] + shift)
+        self.edits.append([self.gen, first, new_end])
+        self.gen += 1
+        if len(self.edits) > self.sweep_every: self.sweep()
+    def sweep(self):
+        # drops every entry an edit invalidated at once so the edit list can be cleared
+        for rows, base in ((self.rows, 0), (self.after, self.n)):
+            for key, row in rows.items():
+                idx = key + base
+                for layer, (match, err, length, reach, gen) in list(row.items()):
+                    if any(edit_gen >= gen and idx < lo <= idx + reach for edit_gen, lo, hi in self.edits):
+                        del row[layer]
+                        self.size -= 1
+        self.edits = []
+
 def Token(type: str, value, start: Position, stop: Position): return {"type": type, "value": value, "start": start, "stop": stop}
 
-def lex(fn: str, text: str, lexer: t.Lexer) -> list:
+def match_rules(rules: list, text: str, i: int) -> tuple:
+    # (end, kind) of the first of the dispatched rules that matches a non-empty token at i, see
+    # transform.rule_dispatch. (None, None) when none does
+    for literal, pattern, kind in rules:
+        if literal is None:
+            m = pattern.match(text, i)
+            if m and m.end() > i: return m.end(), kind
+        elif type(literal) is str:
+            if text.startswith(literal, i): return i + len(literal), kind
+        else:
+            best = None
+            for n, words in literal:
+                hit = words.get(text[i:i+n])
+                if hit is not None and (best is None or hit < best): best = hit
+            if best is not None: return i + best[2], best[1]
+    return None, None
+def lex(fn: str, text: str, lexer: t.Lexer, positions: bool = True, editable: bool = False) -> Tokens:
+    # without positions the tokens keep only their kinds and values, not the source text,
+    # editable tokens can be updated by relex. bytes and mmap text is lexed with the rules compiled
+    # as bytes patterns, positions then count bytes
     file = File(fn, text)
-    pos = Position(-1, 1, -1, file)
-    pos.advance()
-    tokens = []
-    def match(pattern: str):
-        try: m = re.search(pattern, pos.sub())
-        except re.error as e: return None, MatchError(e.msg, pattern, pos.copy(), pos.copy())
-        if m: return m.string[m.start():m.end()] if pos.sub().startswith(m.string[m.start():m.end()]) else None, None
-        return None, None
-    while pos.char() is not None:
-        matched = False
-        for s in lexer.ignore:
-            m, err = match(s.value)
-            if err: return None, err
-            if m:
-                matched = True
-                pos.advance(len(m))
-                break
-        if matched: continue
-        for token in lexer.tokens:
-            if isinstance(token, t.ValueToken):
-                for s in token.strs:
-                    m, err = match(s.value)
-                    if err: return None, err
-                    if m:
-                        matched = True
-                        token_, start = token, pos.copy()
-                        pos.advance(len(m))
-                        tokens.append(Token(token_.name, m, start, pos.copy()))
-                        break
-                if matched: break
-                continue
-            if isinstance(token, t.TokenMatch):
-                for s in token.strs:
-                    m, err = match(s.value)
-                    if err: return None, err
-                    if m:
-                        matched = True
-                        token_, start = token, pos.copy()
-                        pos.advance(len(m))
-                        tokens.append(Token(token_.name, None, start, pos.copy()))
-                        break
-                if matched: break
-                continue
-        if not matched: return None, CharacterError(pos)
-    tokens.append(Token(t.ID("eof", pos.copy(), pos.copy()), None, pos.copy(), pos.copy()))
+    if isinstance(text, str):
+        table, default = lexer.dispatch
+        store = EditTokens if editable else Tokens if positions else BareTokens
+    else:
+        dispatch, err = lexer.compile_bytes()
+        if err: return None, err
+        table, default = dispatch
+        store = ByteTokens if positions else BareTokens
+    tokens = store(file, lexer.kinds, lexer.values)
+    append = tokens.append
+    i, n = 0, len(text)
+    while i < n:
+        # match_rules, inlined
+        for literal, pattern, kind in table.get(text[i], default):
+            if literal is None:
+                m = pattern.match(text, i)
+                if m and m.end() > i:
+                    end = m.end()
+                    break
+            elif type(literal) is str:
+                if text.startswith(literal, i):
+                    end = i + len(literal)
+                    break
+            else:
+                end, kind = match_rules(((literal, None, None),), text, i)
+                if end is not None: break
+        else: return None, CharacterError(file.position(i), None if isinstance(text, str) else text[i:i+4].decode("utf-8", "replace")[0])
+        if kind is not None: append(kind, i, end)
+        i = end
+    append(0, i, i)
+    tokens.close()
+    return tokens, None
+def lex_dfa(fn: str, text: str, lexer: t.Lexer, longest: bool = False, positions: bool = True) -> Tokens:
+    # lex with the rules combined into one DFA, so the time per character doesn't grow with the
+    # number of rules. the first rule that matches wins like in lex, with longest the rule that
+    # matches the most text. rules the DFA can't run are matched with their regex, see src/dfa.py
+    if not isinstance(text, str): return None, Error("the DFA lexer needs str text", None, None)
+    machine = lexer.dfas.get(longest)
+    if machine is None: machine = lexer.dfas[longest] = dfa.build(lexer.rules, longest)
+    file = File(fn, text)
+    tokens = (Tokens if positions else BareTokens)(file, lexer.kinds, lexer.values)
+    append = tokens.append
+    trans, accept, ncls, kinds, fallback = machine.trans, machine.accept, machine.ncls, machine.kinds, machine.fallback
+    skip = [None if p is None else p.match for p in machine.skip]
+    # the class of every character, one byte each
+    classes = text.translate(machine.classes).encode("latin-1")
+    i, n, none = 0, len(text), len(kinds)
+    while i < n:
+        s, j, rule, end = 0, i, none, i
+        while j < n:
+            s = trans[s * ncls + classes[j]]
+            if s < 0: break
+            j += 1
+            if skip[s] is not None: j = skip[s](classes, j).end()
+            if accept[s] >= 0: rule, end = accept[s], j
+        for index, first, pattern in fallback:
+            if not longest and index > rule: break
+            if first is not None and text[i] not in first: continue
+            m = pattern.match(text, i)
+            if m and m.end() > i:
+                if not longest:
+                    rule, end = index, m.end()
+                    break
+                if m.end() > end or m.end() == end and index < rule: rule, end = index, m.end()
+        if end == i: return None, CharacterError(file.position(i))
+        kind = kinds[rule]
+        if kind is not None: append(kind, i, end)
+        i = end
+    append(0, i, i)
+    tokens.close()
     return tokens, None
-def parse(tokens: list, parser: t.Parser, error: t.Error, DEBUG: bool = False) -> dict:
+def relex(tokens: EditTokens, lexer: t.Lexer, offset: int, removed: int, inserted: str) -> tuple:
+    # replaces `removed` characters at offset by inserted and re-lexes from one token before the
+    # edit until a token starts where an old one did behind it. returns the replaced token index
+    # range (first, old end, new end), tokens are left as they were on errors
+    file = tokens.file.edit(offset, removed, inserted)
+    text, shift, edit_end = file.text, len(inserted) - removed, offset + len(inserted)
+    n = len(tokens)
+    lo, hi = 0, n - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if tokens.offset(tokens.stop, mid) < offset: lo = mid + 1
+        else: hi = mid
+    first = max(lo - 1, 0)
+    i = tokens.offset(tokens.stop, first - 1) if first else 0
+    kinds, starts, stops = array("i"), array("q"), array("q")
+    table, default = lexer.dispatch
+    j, old_end = first, n - 1
+    while i < len(text):
+        end, kind = match_rules(table.get(text[i], default), text, i)
+        if end is None: return None, CharacterError(file.position(i))
+        if kind is not None:
+            if i > edit_end:
+                while j < n - 1 and tokens.offset(tokens.start, j) + shift < i: j += 1
+                if tokens.offset(tokens.start, j) + shift == i:
+                    old_end = j
+                    break
+            kinds.append(kind)
+            starts.append(i)
+            stops.append(end)
+        i = end
+    tokens.splice(first, old_end, kinds, starts, stops, file)
+    return (first, old_end, first + len(kinds)), None
+def parse(tokens: list, parser: t.Parser, error: t.Error, DEBUG: bool = False, memo: Memo = None, tracer: Tracer = None) -> dict:
     if not tokens: return None, None
     if len(tokens) == 0: return None, None
     if not parser: return None, Error('no parser defined', tokens[0]['start'], tokens[-1]['stop'])
-    global indent, idx, token
-    indent = 0
-    idx = 0
-    token = tokens[idx]
-    def token_str(t: dict = None) -> str:
-        if t is None:
-            return f"[{token['type']}{':'+token['value'] if token['value'] is not None else ''}]"
-        return f"[{t['type']}{':'+t['value'] if t['value'] is not None else ''}]"
-    def debug(name: str, x):
-        if not DEBUG: return
-        global indent, token
-        print(f"{' '*indent}{idx}{token_str()}    {name} {x}")
-    def debug_enter(name: str, x):
-        if not DEBUG: return
-        global indent, token
-        print(f"{' '*indent}{idx}{token_str()} -> {name} {x}")
-        indent += 1
-    def debug_exit(name: str, x, *results):
-        if not DEBUG: return
-        global indent, token
-        indent -= 1
-        print(f"{' '*indent}{idx}{token_str()} <- {name} {x} ({', '.join([(str(result) if result is not None else '') for result in results])})")
-    def update():
-        global token, idx
-        if idx < len(tokens): token = tokens[idx]
-    def advance():
-        global idx, token
-        idx += 1
-        update()
+    ast, err, _ = parse_from(tokens, parser, error, parser.start_layer, 0, DEBUG, memo, tracer)
+    return ast, err
+class ErrorNode(dict):
+    # node standing in for a layer match that failed with an error and was skipped
+    pass
+def token_at(tokens: Tokens, idx: int):
+    # past the end the parser keeps seeing the last token (eof)
+    try: return tokens[idx]
+    except IndexError: return tokens[len(tokens)-1]
+def get_var(var: t.Var, tokens: Tokens, idx: int):
+    token = token_at(tokens, idx)
+    if var.value == "file_name": return tokens.file.fn
+    if var.value == "token": return token["type"]
+    if var.value == "start_ln": return token["start"].ln if token["start"] else None
+    if var.value == "start_col": return token["start"].col if token["start"] else None
+    return None
+def format_error(call: t.ErrorCall, tokens: Tokens, idx: int) -> tuple:
+    # (None, message) of an ERROR link reached at token index idx
+    error_def = call.target
+    if not error_def: return None, IDNotDefinedError(call.name, call.start, call.stop)
+    args = []
+    for arg in call.args:
+        if isinstance(arg, t.Var):
+            value = get_var(arg, tokens, idx)
+            args.append(value if value is not None else "?")
+        elif isinstance(arg, t.String):
+            args.append(arg.value)
+        else:
+            args.append(str(arg))
+    s, i = "", 0
+    while i < len(error_def.str.value):
+        if error_def.str.value[i] == "%":
+            i += 1
+            if not error_def.str.value[i].isdigit():
+                s += "?"
+                i += 1
+                continue
+            s += str(args[int(error_def.str.value[i])-1]) if int(error_def.str.value[i])-1 < len(args) else "?"
+            i += 1
+        else:
+            s += error_def.str.value[i]
+            i += 1
+    return None, s
+class Recovery:
+    # what parse_from found in recover mode: token index -> the first error recovered from there,
+    # also in alternatives that were backtracked later, and the furthest token index looked at
+    def __init__(self):
+        self.errors, self.furthest = {}, 0
+def parse_recover(tokens: list, parser: t.Parser, error: t.Error, memo: Memo = None, tracer: Tracer = None) -> tuple:
+    # parses past errors inside layers that declare SYNC tokens and returns the partial AST
+    # with every error, recovered ones are left in the AST as Error nodes. when the start layer
+    # doesn't match up to eof the token at the furthest index reached is reported as unexpected
+    if not parser: return None, [Error('no parser defined', tokens[0]['start'], tokens[-1]['stop'])]
+    recovery = Recovery()
+    ast, err, end = parse_from(tokens, parser, error, parser.start_layer, 0, False, memo, tracer, recovery)
+    errors = [e for _, e in sorted(recovery.errors.items(), key=lambda item: item[0])]
+    if err: errors.append(err)
+    elif not ast or end < len(tokens) - 1: errors.append(UnexpectedError(tokens[min(max(recovery.furthest, end), len(tokens) - 1)]))
+    return ast, errors
+def parse_arena(tokens: Tokens, parser: t.Parser, error: t.Error, memo: Memo = None, tracer: Tracer = None) -> tuple:
+    # same as parse, but the AST is kept in an Arena of flat arrays and returned as views on it.
+    # the refs a memo stores belong to one arena, so a memo can't be shared with other parses
+    if not parser: return None, Error('no parser defined', tokens[0]['start'], tokens[-1]['stop'])
+    arena = Arena(tokens)
+    ref, err, _ = parse_from(tokens, parser, error, parser.start_layer, 0, False, memo, tracer, arena=arena)
+    return arena.view(ref) if ref else ref, err
+def parse_from(tokens: list, parser: t.Parser, error: t.Error, x, start: int = 0, DEBUG: bool = False, memo: Memo = None, tracer: Tracer = None, recover: Recovery = None, arena: Arena = None) -> tuple:
+    # matches the pattern element x at token index start and returns (match, err, end index),
+    # all parse state lives in this call so parses can run concurrently
+    idx = start
+    kind = tokens.kind
+    if DEBUG and tracer is None: tracer = PrintTracer()
     def next():
-        token_ = token.copy()
-        advance()
-        return token_
-    def get_var(var: t.Var):
-        if var.value == "file_name": return token["start"].file.fn
-        if var.value == "token": return token["type"]
-        if var.value == "start_ln": return token["start"].ln
-        if var.value == "start_col": return token["start"].col
-        return None
+        nonlocal idx
+        token = token_at(tokens, idx)
+        idx += 1
+        return token
     def match_any(x):
         if isinstance(x, t.ID): return visit_layer(x)
         if isinstance(x, t.Token): return match_token(x)
@@ -142,155 +410,461 @@ def parse(tokens: list, parser: t.Parser, error: t.Error, DEBUG: bool = False) -
         if isinstance(x, t.Repeat): return match_repeat(x)
         return None, PatternMatchError(x)
     def match_token(tok: t.Token):
-        debug_enter("token", tok)
-        if token["type"].value == tok.value[0]:
-            debug_exit("token", tok, token["type"])
-            return next(), None
-        debug_exit("token", tok, False)
+        try: k = kind[idx]
+        except IndexError: k = kind[-1]
+        if k == tok.kind: return next(), None
         return False, None
     def match_group(group: t.Group):
-        debug_enter("group", group)
         for e in group.group:
             match, err = match_any(e)
-            if err:
-                debug_exit("group", group, match["type"] if match else match, True if err else None)
-                return None, err
-            if match:
-                debug_exit("group", group, match["type"] if match else match)
-                return match, None
-        debug_exit("group", group, False)
+            if err: return None, err
+            if match: return match, None
         return False, None
     def match_repeat(repeat: t.Repeat):
-        debug_enter("repeat", repeat)
         matches = []
         match, err = match_any(repeat.node)
-        if err:
-            debug_exit("repeat", repeat, match["type"] if match else match, True if err else None)
-            return None, err
+        if err: return None, err
         if match:
             matches.append(match)
             while match:
                 match, err = match_any(repeat.node)
-                if err:
-                    debug_exit("repeat loop", repeat, match["type"] if match else match, True if err else None)
-                    return None, err
+                if err: return None, err
                 if not match: break
                 matches.append(match)
-            debug_exit('repeat', repeat, len(matches))
             return matches, None
-        debug_exit("group", repeat, False)
         return False, None
     def match_binary(binary: t.Binary):
-        debug_enter("binary", binary)
+        nonlocal idx
         left, err = match_any(binary.left)
-        if err:
-            debug_exit("binary on left", binary, None, True)
-            return None, err
+        if err: return None, err
         if not left: return None, None
+        operand, after = left, idx
         op, err = match_any(binary.op)
-        if err:
-            debug_exit("binary on op", binary, None, True)
-            return None, err
+        if err: return None, err
         if not op:
-            debug_exit("binary on op", binary)
-            return None, None
+            if not binary.optional: return None, None
+            idx = after
+            return left, None
         while op:
             right, err = match_any(binary.right)
-            if err:
-                debug_exit("binary on right", binary, None, True)
-                return None, err
+            if err: return None, err
             if not right:
-                debug_exit("binary on right", binary)
-                return None, None
+                if not binary.optional: return None, None
+                idx = after
+                return operand, None
             left = {"type": "BinaryOperation", "left": left, "op": op, "right": right}
             op, err = match_any(binary.op)
-            if err:
-                debug_exit("binary on op loop", binary, None, True)
-                return None, err
+            if err: return None, err
             if not op: break
-        debug_exit("binary", binary, left['type'])
         return left, None
+    def match_alternative(to: t.To, prefix: tuple = None):
+        # prefix is (start, matches) of the elements a Factored matched for the alternative
+        if prefix is None: rec, pattern = [], to.pattern.pattern
+        else: rec, pattern = prefix[1][:], to.pattern.pattern[len(prefix[1]):]
+        for e in pattern:
+            match, err = match_any(e)
+            if err: return None, err
+            if not match: return False, None
+            rec.append(match)
+        node_vars = to.node.vars
+        if isinstance(to.node.name, t.Int):
+            node = rec[to.node.name.value-1]
+            # memoized matches are shared, so extend a copy
+            if node_vars: node = dict(node)
+        else:
+            node = {"type": to.node.name.value}
+        for k in node_vars:
+            if node_vars[k].value-1 >= len(rec): raise Exception("index error for patterns")
+            node[k] = rec[+node_vars[k].value-1]
+        return node, None
+    def match_factored(f: t.Factored):
+        # the shared prefix once, then the alternatives in order from where it ends
+        nonlocal idx
+        start, rec = idx, []
+        for e in f.prefix:
+            match, err = match_any(e)
+            if err: return None, err
+            if not match: return False, None
+            rec.append(match)
+        prefix, after = (start, rec), idx
+        for to in f.alternatives:
+            idx = after
+            match, err = match_alternative(to, prefix)
+            if err: return None, err
+            if match: return match, None
+        return False, None
     def match_layer(layer: t.Layer):
-        global idx
-        match = True
-        debug_enter("patterns", len(layer.patterns))
-        for to in layer.patterns:
+        nonlocal idx
+        try: k = kind[idx]
+        except IndexError: k = kind[-1]
+        for to in layer.predict.get(k, layer.fallback):
             idx_ = idx
-            debug("pattern", to.pattern.pattern)
             if isinstance(to, t.To):
-                rec = []
-                for e in to.pattern.pattern:
-                    match, err = match_any(e)
-                    if err:
-                        debug_exit("pattern", to.pattern.pattern, None, True)
-                        return None, err
-                    if not match: break
-                    rec.append(match)
-                if match:
-                    if isinstance(to.node.name, t.Int):
-                        node = rec[to.node.name.value-1]
-                    else:
-                        node = {"type": to.node.name.value}
-                    node_vars = to.node.vars
-                    for k in node_vars:
-                        if node_vars[k].value-1 >= len(rec): raise Exception("index error for patterns")
-                        node[k] = rec[+node_vars[k].value-1]
-                    debug_exit("pattern", to.pattern.pattern, node["type"] if node else node)
-                    return node, None
+                match, err = match_alternative(to)
+                if err: return None, err
+                if match: return match, None
+            elif isinstance(to, t.Factored):
+                match, err = match_factored(to)
+                if err: return None, err
+                if match: return match, None
             idx = idx_
-            update()
         if layer.link_layer: return visit_layer(layer.link_layer)
         return False, None
+    def error_call(call: t.ErrorCall):
+        return format_error(call, tokens, idx)
     def visit_layer(name):
-        debug_enter("layer", name)
-        if isinstance(name, t.ErrorCall) and error:
-            error_def = error.get_def(name.name)
-            if not error_def: return None, IDNotDefinedError(name.name, name.start, name.stop)
-            args = []
-            for arg in name.args:
-                if isinstance(arg, t.Var):
-                    value = get_var(arg)
-                    args.append(value if value is not None else "?")
-                elif isinstance(arg, t.String):
-                    args.append(arg.value)
-                else:
-                    args.append(str(arg))
-            if isinstance(error_def, t.ErrorDef):
-                s, i = "", 0
-                while i < len(error_def.str.value):
-                    if error_def.str.value[i] == "%":
-                        i += 1
-                        if not error_def.str.value[i].isdigit():
-                            s += "?"
-                            i += 1
-                            continue
-                        s += str(args[int(error_def.str.value[i])-1]) if int(error_def.str.value[i])-1 < len(args) else "?"
-                        i += 1
-                    else:
-                        s += error_def.str.value[i]
-                        i += 1
-                return None, s
-
-        layer = parser.get_layer(name)
-        if not layer:
-            debug_exit("layer", name, None, "IDNotDefinedError")
-            return None, IDNotDefinedError(name, parser.start, parser.stop)
+        nonlocal idx
+        if isinstance(name, t.ErrorCall): return error_call(name)
+        layer = name.target
+        if not layer: return None, IDNotDefinedError(name, parser.start, parser.stop)
+        if memo is not None:
+            entry = memo.get(layer, idx)
+            if entry is not None:
+                match, err, idx = entry
+                return match, err
+            start = idx
         match, err = match_layer(layer)
-        debug_exit("layer", name, match["type"] if type(match) is dict else match, True if err else None)
+        if memo is not None: memo.put(layer, start, (match, err, idx))
         return match, err
-    ast, err = visit_layer(parser.start_layer)
+    if arena is not None:
+        # matches are arena refs instead of dicts, lists and token views. without a memo nothing
+        # outside an alternative refers to the nodes it made, so they are dropped when it fails
+        last = len(tokens) - 1
+        binary_shape, shapes = arena.shape_id("BinaryOperation", ("left", "op", "right")), {}
+        def match_token(tok: t.Token):
+            nonlocal idx
+            try: k = kind[idx]
+            except IndexError: k = kind[-1]
+            if k != tok.kind: return False, None
+            idx += 1
+            return -min(idx, last + 1), None
+        def match_repeat(repeat: t.Repeat):
+            start, refs = idx, []
+            while True:
+                match, err = match_any(repeat.node)
+                if err: return None, err
+                if not match: break
+                refs.append(match)
+            if not refs: return False, None
+            return arena.node(LIST, refs, start, idx), None
+        def match_binary(binary: t.Binary):
+            nonlocal idx
+            start = idx
+            left, err = match_any(binary.left)
+            if err: return None, err
+            if not left: return None, None
+            operand, after, mark = left, idx, arena.mark()
+            op, err = match_any(binary.op)
+            if err: return None, err
+            if not op:
+                if not binary.optional: return None, None
+                idx = after
+                return left, None
+            while op:
+                right, err = match_any(binary.right)
+                if err: return None, err
+                if not right:
+                    if not binary.optional: return None, None
+                    if memo is None: arena.release(mark)
+                    idx = after
+                    return operand, None
+                left = arena.node(binary_shape, (left, op, right), start, idx)
+                op, err = match_any(binary.op)
+                if err: return None, err
+                if not op: break
+            return left, None
+        def match_alternative(to: t.To, prefix: tuple = None):
+            if prefix is None: start, rec, pattern = idx, [], to.pattern.pattern
+            else: start, rec, pattern = prefix[0], prefix[1][:], to.pattern.pattern[len(prefix[1]):]
+            mark = arena.mark()
+            for e in pattern:
+                match, err = match_any(e)
+                if err: return None, err
+                if not match:
+                    if memo is None: arena.release(mark)
+                    return False, None
+                rec.append(match)
+            node_vars, name = to.node.vars, to.node.name
+            for k in node_vars:
+                if node_vars[k].value-1 >= len(rec): raise Exception("index error for patterns")
+            refs = [rec[node_vars[k].value-1] for k in node_vars]
+            if isinstance(name, t.Int):
+                if not node_vars: return rec[name.value-1], None
+                refs.insert(0, rec[name.value-1])
+            shape = shapes.get(to)
+            if shape is None:
+                base = isinstance(name, t.Int)
+                shape = shapes[to] = arena.shape_id(None if base else name.value, tuple(node_vars), base)
+            return arena.node(shape, refs, start, idx), None
+        def match_factored(f: t.Factored):
+            nonlocal idx
+            start, mark, rec = idx, arena.mark(), []
+            for e in f.prefix:
+                match, err = match_any(e)
+                if err: return None, err
+                if not match:
+                    if memo is None: arena.release(mark)
+                    return False, None
+                rec.append(match)
+            prefix, after = (start, rec), idx
+            for to in f.alternatives:
+                idx = after
+                match, err = match_alternative(to, prefix)
+                if err: return None, err
+                if match: return match, None
+            if memo is None: arena.release(mark)
+            return False, None
+    if isinstance(memo, EditMemo):
+        # entries also record the furthest token read while matching them, so edits can tell
+        # which of them they reach
+        far = start
+        untracked_token = match_token
+        def match_token(tok: t.Token):
+            nonlocal far
+            if idx > far: far = idx
+            return untracked_token(tok)
+        def visit_layer(name):
+            nonlocal idx, far
+            if idx > far: far = idx
+            if isinstance(name, t.ErrorCall): return error_call(name)
+            layer = name.target
+            if not layer: return None, IDNotDefinedError(name, parser.start, parser.stop)
+            entry = memo.get(layer, idx)
+            if entry is not None:
+                match, err, idx, reach = entry
+                if reach > far: far = reach
+                return match, err
+            start, outer, far = idx, far, idx
+            match, err = match_layer(layer)
+            memo.put(layer, start, (match, err, idx, far))
+            if outer > far: far = outer
+            return match, err
+    if recover is not None:
+        strict_layer, strict_token = visit_layer, match_token
+        def match_token(tok: t.Token):
+            if idx > recover.furthest: recover.furthest = idx
+            return strict_token(tok)
+        def visit_layer(name):
+            # on an error inside a layer with SYNC tokens, skips past the next of them (or to eof)
+            # and matches an Error node instead, as long as that moved past the layer's start
+            nonlocal idx
+            start = idx
+            match, err = strict_layer(name)
+            if err is None or isinstance(name, t.ErrorCall) or not name.target or not name.target.sync: return match, err
+            at, last = idx, len(tokens) - 1
+            sync = {tok.kind for tok in name.target.sync}
+            while idx < last and kind[idx] not in sync: idx += 1
+            if idx < last: idx += 1
+            if idx <= start:
+                idx = at
+                return match, err
+            recover.errors.setdefault(at, err)
+            return ErrorNode(type="Error", error=err, token=tokens[min(at, last)]), None
+    if tracer is not None:
+        # the matchers look each other up through these names, so rebinding them
+        # instruments every call while the untraced path stays free of checks
+        tracer.begin(tokens)
+        def traced(what: str, f):
+            def g(x):
+                tracer.enter(what, x, idx)
+                match, err = f(x)
+                tracer.exit(what, x, idx, match, err)
+                return match, err
+            return g
+        match_group, match_repeat, match_binary, visit_layer = traced("group", match_group), \
+            traced("repeat", match_repeat), traced("binary", match_binary), traced("layer", visit_layer)
+        untraced_token, untraced_alternative, untraced_error = match_token, match_alternative, error_call
+        def match_token(tok: t.Token):
+            start = idx
+            match, err = untraced_token(tok)
+            tracer.token(tok, start, bool(match))
+            return match, err
+        def match_alternative(to: t.To, prefix: tuple = None):
+            start = idx
+            tracer.enter("alternative", to, start)
+            match, err = untraced_alternative(to, prefix)
+            if not match and not err: tracer.backtrack(to, start, idx)
+            tracer.exit("alternative", to, idx, match, err)
+            return match, err
+        def error_call(call: t.ErrorCall):
+            match, err = untraced_error(call)
+            tracer.error(call, err, idx)
+            return match, err
+    match, err = match_any(x)
+    return match, err, idx
+
+def parse_stack(tokens: list, parser: t.Parser, error: t.Error, memo: Memo = None, max_depth: int = 1 << 20) -> dict:
+    # same as parse, but how many layers can be matched inside each other is bounded by max_depth
+    # instead of the recursion limit
+    if not tokens: return None, None
+    if len(tokens) == 0: return None, None
+    if not parser: return None, Error('no parser defined', tokens[0]['start'], tokens[-1]['stop'])
+    ast, err, _ = parse_from_stack(tokens, parser, error, parser.start_layer, 0, memo, max_depth)
     return ast, err
+def parse_from_stack(tokens: list, parser: t.Parser, error: t.Error, x, start: int = 0, memo: Memo = None, max_depth: int = 1 << 20) -> tuple:
+    # parse_from on an explicit stack: layers, groups, repetitions and binaries are generators
+    # that yield the element they want matched and are sent back its (match, err). depth counts
+    # the layer generators on the stack, the others between two of them are bounded by the grammar
+    idx = start
+    depth = 0
+    kind = tokens.kind
+    def match_token(tok: t.Token):
+        nonlocal idx
+        try: k = kind[idx]
+        except IndexError: k = kind[-1]
+        if k == tok.kind:
+            idx += 1
+            return token_at(tokens, idx - 1), None
+        return False, None
+    def match_group(group: t.Group):
+        for e in group.group:
+            match, err = yield e
+            if err: return None, err
+            if match: return match, None
+        return False, None
+    def match_repeat(repeat: t.Repeat):
+        matches = []
+        match, err = yield repeat.node
+        if err: return None, err
+        if match:
+            matches.append(match)
+            while match:
+                match, err = yield repeat.node
+                if err: return None, err
+                if not match: break
+                matches.append(match)
+            return matches, None
+        return False, None
+    def match_binary(binary: t.Binary):
+        nonlocal idx
+        left, err = yield binary.left
+        if err: return None, err
+        if not left: return None, None
+        operand, after = left, idx
+        op, err = yield binary.op
+        if err: return None, err
+        if not op:
+            if not binary.optional: return None, None
+            idx = after
+            return left, None
+        while op:
+            right, err = yield binary.right
+            if err: return None, err
+            if not right:
+                if not binary.optional: return None, None
+                idx = after
+                return operand, None
+            left = {"type": "BinaryOperation", "left": left, "op": op, "right": right}
+            op, err = yield binary.op
+            if err: return None, err
+            if not op: break
+        return left, None
+    def match_alternative(to: t.To, rec: list, pattern: list):
+        # the rest of a factored alternative after the matches of its prefix in rec
+        for e in pattern:
+            match, err = yield e
+            if err: return None, err
+            if not match: return False, None
+            rec.append(match)
+        return make_node(to, rec), None
+    def make_node(to: t.To, rec: list):
+        node_vars = to.node.vars
+        if isinstance(to.node.name, t.Int):
+            node = rec[to.node.name.value-1]
+            if node_vars: node = dict(node)
+        else:
+            node = {"type": to.node.name.value}
+        for k in node_vars:
+            if node_vars[k].value-1 >= len(rec): raise Exception("index error for patterns")
+            node[k] = rec[+node_vars[k].value-1]
+        return node
+    def match_layer(layer: t.Layer):
+        nonlocal idx
+        try: k = kind[idx]
+        except IndexError: k = kind[-1]
+        for to in layer.predict.get(k, layer.fallback):
+            idx_ = idx
+            if isinstance(to, t.To):
+                rec = []
+                for e in to.pattern.pattern:
+                    match, err = yield e
+                    if err: return None, err
+                    if not match: break
+                    rec.append(match)
+                else: return make_node(to, rec), None
+            elif isinstance(to, t.Factored):
+                prefix = []
+                for e in to.prefix:
+                    match, err = yield e
+                    if err: return None, err
+                    if not match: break
+                    prefix.append(match)
+                else:
+                    after = idx
+                    for alternative in to.alternatives:
+                        idx = after
+                        match, err = yield from match_alternative(alternative, prefix[:], alternative.pattern.pattern[len(prefix):])
+                        if err: return None, err
+                        if match: return match, None
+            idx = idx_
+        if layer.link_layer: return (yield layer.link_layer)
+        return False, None
+    def visit_layer(layer: t.Layer):
+        nonlocal idx
+        start = idx
+        match, err = yield from match_layer(layer)
+        memo.put(layer, start, (match, err, idx))
+        return match, err
+    layer_codes = (match_layer.__code__, visit_layer.__code__)
+    stack, e = [], x
+    while True:
+        # start matching e, either directly or by pushing its generator
+        result = None
+        if isinstance(e, t.Token): result = match_token(e)
+        elif isinstance(e, t.ErrorCall): result = format_error(e, tokens, idx)
+        elif isinstance(e, t.ID):
+            layer = e.target
+            entry = memo.get(layer, idx) if layer and memo is not None else None
+            if not layer: result = None, IDNotDefinedError(e, parser.start, parser.stop)
+            elif entry is not None:
+                match, err, idx = entry
+                result = match, err
+            elif depth == max_depth:
+                token = token_at(tokens, idx)
+                result = None, DepthError(max_depth, token["start"], token["stop"])
+            else:
+                depth += 1
+                stack.append(visit_layer(layer) if memo is not None else match_layer(layer))
+        elif isinstance(e, t.Group): stack.append(match_group(e))
+        elif isinstance(e, t.Binary): stack.append(match_binary(e))
+        elif isinstance(e, t.Repeat): stack.append(match_repeat(e))
+        else: result = None, PatternMatchError(e)
+        # resume the innermost matcher until one asks for another element
+        while stack:
+            try:
+                e = stack[-1].send(result)
+                break
+            except StopIteration as stop:
+                if stack.pop().gi_code in layer_codes: depth -= 1
+                result = stop.value
+        else: return result[0], result[1], idx
 
-def from_file(fn: str, lang: t.Language, debug: bool = False) -> dict:
+def map_file(f) -> mmap.mmap:
+    # read-only mapping of an open binary file, empty files can't be mapped
+    try: return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError: return b""
+def from_file(fn: str, lang: t.Language, debug: bool = False, memo: Memo = None, positions: bool = True, tracer: Tracer = None, arena: bool = False, mapped: bool = False) -> dict:
+    # mapped lexes the memory-mapped bytes of the file instead of its decoded text, token values
+    # are then memoryviews into the mapping
     try:
-        with open(fn, "r") as f:
-            text = f.read()
-            tokens, err = lex(fn, text, lang.lexer)
+        with open(fn, "rb" if mapped else "r") as f:
+            text = map_file(f) if mapped else f.read()
+            tokens, err = lex(fn, text, lang.lexer, positions)
             if debug:
                 for tok in tokens: print(f"[{tok['type']}{':'+repr(tok['value']) if tok['value'] is not None else ''}]")
                 print()
             if err: return None, err
-            ast, err = parse(tokens, lang.parser, lang.error, debug)
+            ast, err = parse_arena(tokens, lang.parser, lang.error, memo, tracer) if arena else parse(tokens, lang.parser, lang.error, debug, memo, tracer)
             if err: return None, err
             if debug: print(ast)
             return ast, err
@@ -298,12 +872,269 @@ def from_file(fn: str, lang: t.Language, debug: bool = False) -> dict:
         return None, f"file '{fn}' not found in cwd"
 
 
-def from_text(text: str, lang: t.Language, debug: bool = False) -> dict:
-    tokens, err = lex("<text-input>", text, lang.lexer)
+def from_text(text: str, lang: t.Language, debug: bool = False, memo: Memo = None, positions: bool = True, tracer: Tracer = None, arena: bool = False) -> dict:
+    tokens, err = lex("<text-input>", text, lang.lexer, positions)
     if debug:
         for tok in tokens: print(f"[{tok['type']}{':'+tok['value'] if tok['value'] is not None else ''}]")
     if err: return None, err
-    ast, err = parse(tokens, lang.parser, debug)
+    ast, err = parse_arena(tokens, lang.parser, lang.error, memo, tracer) if arena else parse(tokens, lang.parser, lang.error, debug, memo, tracer)
     if err: return None, err
     if debug: print(ast)
     return ast, err
+
+
+class Document:
+    # a text that is edited over time: edits re-lex the tokens around them and re-parse with the
+    # memo of the previous parse, so only layer matches that read changed tokens run again
+    def __init__(self, fn: str, text: str, lang: t.Language):
+        self.fn, self.text, self.lang = fn, text, lang
+        self.tokens, self.memo = None, None
+    def parse(self) -> tuple:
+        if self.tokens is None:
+            tokens, err = lex(self.fn, self.text, self.lang.lexer, editable=True)
+            if err: return None, err
+            self.tokens, self.memo = tokens, EditMemo(len(tokens))
+        return parse(self.tokens, self.lang.parser, self.lang.error, memo=self.memo)
+    def edit(self, offset: int, removed: int, inserted: str) -> tuple:
+        # replaces `removed` characters at offset by inserted and returns the new (ast, err)
+        if self.tokens is not None:
+            change, err = relex(self.tokens, self.lang.lexer, offset, removed, inserted)
+            if err:
+                self.text = self.text[:offset] + inserted + self.text[offset+removed:]
+                self.tokens = self.memo = None
+                return None, err
+            self.memo.edit(*change)
+            self.text = self.tokens.file.text
+        else: self.text = self.text[:offset] + inserted + self.text[offset+removed:]
+        return self.parse()
+
+
+class TokenWindow:
+    # lazily filled view of a token iterator that keeps absolute indices while the
+    # tokens before the last finished node are dropped
+    def __init__(self, file: File, tokens):
+        self.file, self.tokens, self.buf, self.offset, self.done, self.err = file, iter(tokens), [], 0, False, None
+        self.kinds = array("i")
+        self.kind = KindColumn(self)
+    def __len__(self):
+        # one past the buffered tokens until the iterator runs dry, so the parser keeps pulling
+        return self.offset + len(self.buf) + (0 if self.done else 1)
+    def fill(self, i: int):
+        while i >= len(self.buf) and not self.done:
+            kind, tok, err = next(self.tokens, (None, None, None))
+            if err:
+                # end the input where lexing failed so the parser can unwind
+                self.err = err
+                kind, tok = 0, Token(t.ID("eof", err.start, err.start), None, err.start, err.start)
+            if err or tok is None: self.done = True
+            if tok is not None:
+                self.kinds.append(kind)
+                self.buf.append(tok)
+    def __getitem__(self, i: int) -> dict:
+        if i < 0: return self.buf[i]
+        i -= self.offset
+        self.fill(i)
+        return self.buf[i]
+    def drop(self, idx: int):
+        del self.buf[:idx - self.offset]
+        del self.kinds[:idx - self.offset]
+        self.offset = idx
+class KindColumn:
+    def __init__(self, window: TokenWindow):
+        self.window = window
+    def __getitem__(self, i: int) -> int:
+        window = self.window
+        if i < 0: return window.kinds[i]
+        i -= window.offset
+        window.fill(i)
+        return window.kinds[i]
+
+def lex_stream(file: File, f, lexer: t.Lexer, chunk_size: int = 1 << 16):
+    # yields (kind, token, err) while reading f in chunks. a match is only taken with more than
+    # chunk_size characters after it and retried with more input otherwise: a rule can look past
+    # its match, with $, \b or a lookahead, so tokens and what their rules look at up to
+    # chunk_size characters never split
+    table, default = lexer.dispatch
+    buf, base, i, eof = "", 0, 0, False
+    lines, last_nl, scanned = 0, -1, 0
+    def scan(stop: int):
+        nonlocal lines, last_nl, scanned
+        if stop <= scanned: return
+        lines += buf.count("\n", scanned - base, stop - base)
+        nl = buf.rfind("\n", scanned - base, stop - base)
+        if nl >= 0: last_nl = base + nl
+        scanned = stop
+    def position(a: int) -> Position:
+        scan(a + 1)
+        return Position(a, file, lines + 1, a - last_nl if last_nl >= 0 else a)
+    def fill() -> bool:
+        nonlocal buf, base, i, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        scan(base + i)
+        buf, base, i = buf[i:] + chunk, base + i, 0
+        return True
+    while True:
+        while not eof and len(buf) - i < chunk_size: fill()
+        if i >= len(buf): break
+        end, kind = match_rules(table.get(buf[i], default), buf, i)
+        if not eof and (end is None or len(buf) - end <= chunk_size):
+            fill()
+            continue
+        if end is None:
+            yield None, None, CharacterError(position(base + i), buf[i])
+            return
+        start, i = base + i, end
+        if kind is None: continue
+        yield kind, Token(lexer.kinds[kind], buf[start-base:i] if lexer.values[kind] else None, position(start), position(base + i)), None
+    pos = position(base + i)
+    yield 0, Token(lexer.kinds[0], None, pos, pos.copy()), None
+
+def from_stream(f, lang: t.Language, fn: str = "<stream>", debug: bool = False, memo: Memo = None, chunk_size: int = 1 << 16):
+    # yields (node, err) for every node matched by the start layer's top-level repetition
+    # (e.g. `Definition* [eof]`) as soon as it is parsed
+    parser = lang.parser
+    if not parser:
+        yield None, "no parser defined"
+        return
+    layer = parser.start_layer.target
+    if not layer:
+        yield None, IDNotDefinedError(parser.start_layer, parser.start, parser.stop)
+        return
+    to = layer.patterns[0] if layer.patterns else None
+    elements = to.pattern.pattern if isinstance(to, t.To) else []
+    if not elements or not isinstance(elements[0], t.Repeat) or len(elements) > 2 or \
+            (len(elements) == 2 and not (isinstance(elements[1], t.Token) and elements[1].value[0] == "eof")):
+        yield None, Error(f"start layer {layer.name} is not a top-level repetition", layer.start, layer.stop)
+        return
+    item = elements[0].node
+    file = File(fn, "")
+    tokens = TokenWindow(file, lex_stream(file, f, lang.lexer, chunk_size))
+    idx = 0
+    while True:
+        kind = tokens.kind[idx]
+        if tokens.err:
+            yield None, tokens.err
+            return
+        if kind == 0: return
+        node, err, end = parse_from(tokens, parser, lang.error, item, idx, debug, memo)
+        if tokens.err: err = tokens.err
+        if err:
+            yield None, err
+            return
+        if not node:
+            yield None, UnexpectedError(tokens[idx])
+            return
+        yield node, None
+        tokens.drop(end)
+        idx = end
+
+def stream_file(fn: str, lang: t.Language, debug: bool = False, memo: Memo = None, chunk_size: int = 1 << 16):
+    try:
+        with open(fn, "r") as f:
+            yield from from_stream(f, lang, fn, debug, memo, chunk_size)
+    except FileNotFoundError as e:
+        yield None, f"file '{fn}' not found in cwd"
+
+
+# results leave the workers pickled against the worker's Language: the token kind tables are
+# replaced by references, so only the token columns, source text and AST nodes are sent back
+class ResultPickler(pickle.Pickler):
+    def __init__(self, f, lexer: t.Lexer):
+        super().__init__(f, pickle.HIGHEST_PROTOCOL)
+        self.lexer = lexer
+    def persistent_id(self, obj):
+        if obj is self.lexer.kinds: return "kinds"
+        if obj is self.lexer.values: return "values"
+        return None
+class ResultUnpickler(pickle.Unpickler):
+    def __init__(self, f, lexer: t.Lexer):
+        super().__init__(f)
+        self.lexer = lexer
+    def persistent_load(self, pid):
+        if pid == "kinds": return self.lexer.kinds
+        if pid == "values": return self.lexer.values
+        raise pickle.UnpicklingError(f"unknown reference {pid!r}")
+
+def pack(ast) -> tuple:
+    # flattens an AST of node dicts, lists and tokens of one store into an int array in preorder:
+    # a token is -1-index, a list 2*length+1 followed by its items and a node 2*shape followed by
+    # its fields, shape being its type and keys. returns None for anything else
+    codes, shapes, shape_ids, tokens = array("i"), [], {}, None
+    stack = [ast]
+    while stack:
+        x = stack.pop()
+        if type(x) is TokenView:
+            if tokens is None: tokens = x.tokens
+            elif x.tokens is not tokens: return None
+            codes.append(-1 - x.idx)
+        elif type(x) is list:
+            codes.append(2 * len(x) + 1)
+            stack.extend(reversed(x))
+        elif type(x) is dict and type(x.get("type")) is str:
+            shape = (x["type"], tuple(x))
+            sid = shape_ids.get(shape)
+            if sid is None: sid = shape_ids[shape] = len(shapes); shapes.append(shape)
+            codes.append(2 * sid)
+            stack.extend(reversed([v for k, v in x.items() if k != "type"]))
+        else: return None
+    return codes, shapes, tokens
+def unpack(packed: tuple):
+    codes, shapes, tokens = packed
+    fields = [[k for k in keys if k != "type"] for _, keys in shapes]
+    root = [None]
+    # frames of [container, slots still to fill, next slot]
+    stack = [[root, [0], 0]]
+    for c in codes:
+        slots = None
+        if c < 0: x = TokenView(tokens, -1 - c)
+        elif c & 1:
+            x = [None] * (c >> 1)
+            slots = range(c >> 1)
+        else:
+            type_, keys = shapes[c >> 1]
+            x = dict.fromkeys(keys)
+            x["type"] = type_
+            slots = fields[c >> 1]
+        frame = stack[-1]
+        frame[0][frame[1][frame[2]]] = x
+        frame[2] += 1
+        if slots: stack.append([x, slots, 0])
+        else:
+            while stack and stack[-1][2] == len(stack[-1][1]): stack.pop()
+    return root[0]
+
+worker_lang = None
+def init_worker(lang: t.Language):
+    global worker_lang
+    worker_lang = lang
+def parse_worker(fn: str, packrat: bool, positions: bool) -> tuple:
+    ast, err = from_file(fn, worker_lang, memo=Memo() if packrat else None, positions=positions)
+    packed = pack(ast) if ast else None
+    f = io.BytesIO()
+    ResultPickler(f, worker_lang.lexer).dump((packed, None if packed else ast, err))
+    return fn, f.getvalue()
+
+def parse_many(paths, lang: t.Language, workers: int = None, packrat: bool = False, positions: bool = True):
+    # parses the files on a process pool and yields (path, ast, err) as each one finishes,
+    # every worker receives the Language once when it starts
+    # imported here since multiprocessing pulls in modules the example scripts shadow
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(lang,)) as pool:
+        paths = iter(paths)
+        limit = 4 * workers
+        pending = set()
+        while True:
+            for fn in paths:
+                pending.add(pool.submit(parse_worker, fn, packrat, positions))
+                if len(pending) >= limit: break
+            if not pending: return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                fn, data = future.result()
+                packed, ast, err = ResultUnpickler(io.BytesIO(data), lang.lexer).load()
+                if packed: ast = unpack(packed)
+                yield fn, ast, err
@@ -0,0 +1,143 @@
+import src.transform as t
+
+# rewrites of a transformed grammar that leave every parse result as it was, so the parser does
+# less work for it. matching an element is a function of the token index alone, which is what
+# lets an element that matched once stand in for matching it again at the same index
+
+def same(a, b) -> bool:
+    # whether two pattern elements always match the same way
+    if type(a) is not type(b): return False
+    if isinstance(a, t.Token): return a.kind == b.kind and a.value == b.value
+    if isinstance(a, t.ID): return a.target is not None and a.target is b.target
+    if isinstance(a, t.Group): return len(a.group) == len(b.group) and all(map(same, a.group, b.group))
+    if isinstance(a, t.Repeat): return same(a.node, b.node)
+    if isinstance(a, t.Binary):
+        return a.optional == b.optional and same(a.left, b.left) and same(a.op, b.op) and same(a.right, b.right)
+    return False
+
+def describe(to: t.To) -> str:
+    return f"{' '.join(map(t.pattern_str, to.pattern.pattern))} -> {to.node.name}"
+
+def forwards(layer: t.Layer):
+    # the layer a layer only passes on to, like `X { Y -> 1 }` or `X {} Y`
+    if layer.sync: return None
+    if not layer.patterns and isinstance(layer.link_layer, t.ID): return layer.link_layer.target
+    if len(layer.patterns) != 1 or layer.link_layer: return None
+    to = layer.patterns[0]
+    if not isinstance(to, t.To) or len(to.pattern.pattern) != 1 or to.node.vars: return None
+    if not isinstance(to.node.name, t.Int) or to.node.name.value != 1: return None
+    e = to.pattern.pattern[0]
+    return e.target if isinstance(e, t.ID) else None
+
+def inline(parser: t.Parser, changes: list):
+    # references to pass-through layers go to the layer at the end of the chain instead
+    targets = {layer: forwards(layer) for layer in parser.layers}
+    dests = {}
+    for layer, dest in targets.items():
+        seen = {layer}
+        while dest is not None and dest not in seen and targets.get(dest) is not None:
+            seen.add(dest)
+            dest = targets[dest]
+        # layers that pass on in a cycle never match, they are left alone
+        if dest is not None and dest not in seen: dests[layer] = dest
+    counts = {}
+    def replace(e):
+        if isinstance(e, t.ID) and e.target in dests:
+            dest = dests[e.target]
+            counts[e.target] = counts.get(e.target, 0) + 1
+            ref = t.ID(dest.name.value, e.start, e.stop)
+            ref.target = dest
+            return ref
+        if isinstance(e, t.Group): e.group[:] = map(replace, e.group)
+        elif isinstance(e, t.Repeat): e.node = replace(e.node)
+        elif isinstance(e, t.Binary):
+            right = e.right is not e.left
+            e.left, e.op = replace(e.left), replace(e.op)
+            e.right = replace(e.right) if right else e.left
+        return e
+    for layer in parser.layers:
+        for to in layer.patterns:
+            if isinstance(to, t.To): to.pattern.pattern[:] = map(replace, to.pattern.pattern)
+        if layer.link_layer: layer.link_layer = replace(layer.link_layer)
+    parser.start_layer = replace(parser.start_layer)
+    for layer, count in counts.items():
+        changes.append(f"inlined {layer.name.value} at {count} reference{'s' * (count > 1)}, it only matches {dests[layer].name.value}")
+
+def optional_binaries(parser: t.Parser, changes: list):
+    # `L { ... BINARY(A op) -> 1 } A`: when no operation follows the first A the binary fails and
+    # L matches A again through its link. the binary gives back that first A itself instead
+    for layer in parser.layers:
+        link = layer.link_layer
+        if not isinstance(link, t.ID) or link.target is None or not layer.patterns: continue
+        to = layer.patterns[-1]
+        if not isinstance(to, t.To) or len(to.pattern.pattern) != 1 or to.node.vars: continue
+        if not isinstance(to.node.name, t.Int) or to.node.name.value != 1: continue
+        binary = to.pattern.pattern[0]
+        if not isinstance(binary, t.Binary) or binary.optional: continue
+        if not isinstance(binary.left, t.ID) or binary.left.target is not link.target: continue
+        binary.optional = True
+        changes.append(f"{layer.name.value}: {describe(to)} matches a lone {link.value} without falling back to the link")
+
+def drop_shadowed(parser: t.Parser, changes: list, numbers: dict):
+    # an alternative starting with the whole pattern of an earlier one never gets to match: it is
+    # only tried when that pattern failed
+    for layer in parser.layers:
+        kept = []
+        for to in layer.patterns:
+            if isinstance(to, t.To):
+                pattern = to.pattern.pattern
+                cover = next((other for other in kept if isinstance(other, t.To) and len(other.pattern.pattern) <= len(pattern)
+                              and all(map(same, other.pattern.pattern, pattern))), None)
+                if cover is not None:
+                    kind = "has the pattern of" if len(cover.pattern.pattern) == len(pattern) else "starts with the pattern of"
+                    changes.append(f"{layer.name.value}: dropped alternative {numbers[to]} ({describe(to)}), it {kind} alternative {numbers[cover]}")
+                    continue
+            kept.append(to)
+        layer.patterns = kept
+
+def disjoint(a, b) -> bool:
+    # whether a and b can be tried in either order: neither matches without consuming a token
+    # and no token can start both
+    if not isinstance(a, t.To) or not isinstance(b, t.To) or a.nullable or b.nullable: return False
+    return t.ANY not in a.first and t.ANY not in b.first and not a.first & b.first
+
+def factor(parser: t.Parser, changes: list, numbers: dict):
+    # alternatives starting with the same elements match them once. later ones are moved up to
+    # the first of them past alternatives they are disjoint with
+    for layer in parser.layers:
+        patterns, out = list(layer.patterns), []
+        while patterns:
+            to, rest = patterns[0], patterns[1:]
+            if not isinstance(to, t.To) or not to.pattern.pattern:
+                out.append(to)
+                patterns = rest
+                continue
+            group, others = [to], []
+            for other in rest:
+                if isinstance(other, t.To) and other.pattern.pattern and same(other.pattern.pattern[0], to.pattern.pattern[0]) \
+                        and all(disjoint(x, other) for x in others): group.append(other)
+                else: others.append(other)
+            patterns = others
+            if len(group) == 1:
+                out.append(to)
+                continue
+            n = 1
+            while all(len(g.pattern.pattern) > n for g in group) and all(same(g.pattern.pattern[n], to.pattern.pattern[n]) for g in group): n += 1
+            out.append(t.Factored(to.pattern.pattern[:n], group))
+            changes.append(f"{layer.name.value}: alternatives {', '.join(str(numbers[g]) for g in group)} match "
+                           f"{' '.join(map(t.pattern_str, to.pattern.pattern[:n]))} once")
+        layer.patterns = out
+
+def optimize(lang: t.Language) -> tuple:
+    # rewrites lang's parser in place and returns (changes, err), a line describing each change
+    changes = []
+    parser = lang.parser
+    if not parser: return changes, None
+    # alternatives are reported by their place in the grammar
+    numbers = {to: i + 1 for layer in parser.layers for i, to in enumerate(layer.patterns)}
+    inline(parser, changes)
+    optional_binaries(parser, changes)
+    drop_shadowed(parser, changes, numbers)
+    factor(parser, changes, numbers)
+    t.predict(parser)
+    return changes, None
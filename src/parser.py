@@ -120,11 +120,12 @@ class IgnoreNode(Node):
     def __repr__(self):
         return f"(IGNORE " + " ".join([str(n) for n in self.strs]) + ")"
 class LayerNode(Node):
-    def __init__(self, name: l.Token, body: BodyNode, link_layer: l.Token):
+    def __init__(self, name: l.Token, body: BodyNode, link_layer: l.Token, sync: list = None):
         super().__init__(name.start.copy(), body.stop.copy())
-        self.name, self.body, self.link_layer = name, body, link_layer
+        self.name, self.body, self.link_layer, self.sync = name, body, link_layer, sync or []
     def __repr__(self):
-        return f"(LAYER {self.name} " + " ".join([str(n) for n in self.body.nodes]) + (f" {self.link_layer}" if self.link_layer else "") + ")"
+        return f"(LAYER {self.name} " + " ".join([str(n) for n in self.body.nodes]) + (f" SYNC {' '.join([str(n) for n in self.sync])}" if self.sync else "") + \
+            (f" {self.link_layer}" if self.link_layer else "") + ")"
 class PatternNode(Node):
     def __init__(self, elements: list, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
@@ -236,6 +237,11 @@ class Parser:
             link_layer = None
             body, err = self.body(self.layer_stat)
             if err: return None, err
+            sync = []
+            if self.token.type == l.T.SYNC:
+                self.advance()
+                if self.token.type != l.T.TOKEN: return None, ExpectedError(l.T.TOKEN, self.token)
+                while self.token.type == l.T.TOKEN: sync.append(TokenNode(self.next()))
             if self.token.type == l.T.ID:
                 link_layer = IDNode(self.next())
             if self.token.type == l.T.ERROR:
@@ -250,7 +256,7 @@ class Parser:
                     args.append(token)
                 link_layer = ErrorCallNode(error_name, args, start, stop)
             if self.token.type != l.T.NL: return None, UnexpectedError(self.token)
-            return LayerNode(name, body, link_layer), None
+            return LayerNode(name, body, link_layer, sync), None
         return None, ExpectedError(l.T.ID, self.token)
     def layer_stat(self) -> [PatternNode, ToNode]:
         pattern, err = self.pattern()
@@ -0,0 +1,100 @@
+import time
+from src.lexer import File
+from src.llp import Tracer, CharacterError, match_rules
+import src.transform as t
+
+class Profiler(Tracer):
+    # tracer that counts and times every layer and alternative of a parse. self time excludes
+    # the layers called from a layer, total time counts a recursive layer only at its outermost call.
+    # times include the tracing overhead, so they are for comparing layers with each other
+    def __init__(self, parser: t.Parser):
+        self.labels = {}
+        for layer in parser.layers:
+            # the alternatives of a Factored are numbered in line with the others
+            alternatives = [a for to in layer.patterns for a in (to.alternatives if isinstance(to, t.Factored) else [to])]
+            for i, to in enumerate(alternatives): self.labels[to] = f"{layer.name.value}.{i+1} {' '.join(map(t.pattern_str, to.pattern.pattern))}"
+        # name -> [attempts, matches, self ns, total ns]
+        self.layers = {}
+        # label -> [attempts, matches, backtracked tokens, ns]
+        self.alternatives = {}
+        # lex rule label -> [attempts, matches, ns], filled by lex
+        self.rules = {}
+        # "Layer;Layer;..." -> self ns
+        self.stacks = {}
+        self.frames, self.alts, self.active = [], [], {}
+    def enter(self, what: str, x, idx: int):
+        if what == "layer":
+            name = f"ERROR {x.name.value}" if isinstance(x, t.ErrorCall) else x.value
+            self.active[name] = self.active.get(name, 0) + 1
+            self.frames.append([name, time.perf_counter_ns(), 0])
+        elif what == "alternative": self.alts.append(time.perf_counter_ns())
+    def exit(self, what: str, x, idx: int, match, err):
+        if what == "layer":
+            name, start, children = self.frames.pop()
+            total = time.perf_counter_ns() - start
+            stats = self.layers.setdefault(name, [0, 0, 0, 0])
+            stats[0] += 1
+            if match: stats[1] += 1
+            stats[2] += total - children
+            self.active[name] -= 1
+            if not self.active[name]: stats[3] += total
+            if self.frames: self.frames[-1][2] += total
+            key = ";".join([frame[0] for frame in self.frames] + [name])
+            self.stacks[key] = self.stacks.get(key, 0) + total - children
+        elif what == "alternative":
+            stats = self.alternatives.setdefault(self.labels.get(x, str(x)), [0, 0, 0, 0])
+            stats[0] += 1
+            if match: stats[1] += 1
+            stats[3] += time.perf_counter_ns() - self.alts.pop()
+    def backtrack(self, to: t.To, start: int, idx: int):
+        self.alternatives.setdefault(self.labels.get(to, str(to)), [0, 0, 0, 0])[2] += idx - start
+    def lex(self, fn: str, text: str, lexer: t.Lexer):
+        # counts and times the rule tries the way llp.lex makes them, through the lexer's first
+        # character dispatch. a run of literals looked up at once counts as one rule. returns the
+        # CharacterError llp.lex would
+        table, default = lexer.dispatch
+        kind_name = lambda kind: "IGNORE" if kind is None else lexer.kinds[kind].value
+        stats = {}
+        for entry in [*default, *(e for entries in table.values() for e in entries)]:
+            literal, pattern, kind = entry
+            if type(literal) is tuple:
+                hits = sorted(hit for _, words in literal for hit in words.values())
+                label = f"{len(hits)} literals {', '.join(kind_name(kind) for _, kind, _ in hits[:3])}, ..."
+            else: label = f"{kind_name(kind)} {pattern.pattern!r}"
+            stats[id(entry)] = self.rules.setdefault(label, [0, 0, 0])
+        clock, i = time.perf_counter_ns, 0
+        while i < len(text):
+            for entry in table.get(text[i], default):
+                rule = stats[id(entry)]
+                start = clock()
+                end, kind = match_rules((entry,), text, i)
+                rule[2] += clock() - start
+                rule[0] += 1
+                if end is not None:
+                    rule[1] += 1
+                    break
+            else: return CharacterError(File(fn, text).position(i))
+            i = end
+        return None
+    def report(self, out=None, limit: int = 20):
+        # tables sorted by time, the first limit rows of each
+        ms = lambda ns: f"{ns / 1e6:.3f}"
+        print(f"{'layer':<30}{'attempts':>10}{'matches':>10}{'self ms':>12}{'total ms':>12}", file=out)
+        for name, (attempts, matches, self_ns, total) in sorted(self.layers.items(), key=lambda e: -e[1][2])[:limit]:
+            print(f"{name:<30}{attempts:>10}{matches:>10}{ms(self_ns):>12}{ms(total):>12}", file=out)
+        print(file=out)
+        print(f"{'alternative':<50}{'attempts':>10}{'matches':>10}{'backtracked':>13}{'ms':>12}", file=out)
+        for label, (attempts, matches, backtracked, ns) in sorted(self.alternatives.items(), key=lambda e: -e[1][3])[:limit]:
+            if len(label) > 48: label = label[:45] + "..."
+            print(f"{label:<50}{attempts:>10}{matches:>10}{backtracked:>13}{ms(ns):>12}", file=out)
+        if not self.rules: return
+        print(file=out)
+        print(f"{'lex rule':<50}{'attempts':>10}{'matches':>10}{'ms':>12}", file=out)
+        for label, (attempts, matches, ns) in sorted(self.rules.items(), key=lambda e: -e[1][2])[:limit]:
+            if len(label) > 48: label = label[:45] + "..."
+            print(f"{label:<50}{attempts:>10}{matches:>10}{ms(ns):>12}", file=out)
+    def collapsed(self, out):
+        # one "Layer;Layer;... microseconds" line per layer stack, the input flamegraph.pl and
+        # speedscope take
+        for key, ns in sorted(self.stacks.items()):
+            if ns >= 1000: print(f"{key} {ns // 1000}", file=out)
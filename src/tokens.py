@@ -0,0 +1,139 @@
+from array import array
+from collections.abc import Mapping, Sequence
+from src.lexer import File, Position
+
+class TokenView(Mapping):
+    # dict-like view of one token in a Tokens store, the value and positions are only
+    # materialized when they are read
+    __slots__ = ("tokens", "idx", "gen")
+    keys_ = ("type", "value", "start", "stop")
+    def __init__(self, tokens, idx: int):
+        self.tokens, self.idx, self.gen = tokens, idx, tokens.gen
+    def __getitem__(self, key: str):
+        if self.gen != self.tokens.gen: self.resolve()
+        if key == "type": return self.tokens.type(self.idx)
+        if key == "value": return self.tokens.value(self.idx)
+        if key == "start": return self.tokens.start_position(self.idx)
+        if key == "stop": return self.tokens.stop_position(self.idx)
+        raise KeyError(key)
+    def __iter__(self):
+        return iter(self.keys_)
+    def __len__(self):
+        return len(self.keys_)
+    def __repr__(self):
+        return repr(dict(self))
+    def copy(self) -> dict:
+        return dict(self)
+    def __reduce__(self):
+        if self.gen != self.tokens.gen: self.resolve()
+        return TokenView, (self.tokens, self.idx)
+    def resolve(self):
+        # moves the index past the edits made to an EditTokens store since the view was taken,
+        # a token that was replaced maps to the first token of its replacement
+        idx, log = self.idx, self.tokens.log
+        for gen in range(self.gen, self.tokens.gen):
+            first, old_end, new_end = log[gen]
+            if idx >= old_end: idx += new_end - old_end
+            elif idx >= first: idx = first
+        self.idx, self.gen = idx, self.tokens.gen
+
+class Tokens(Sequence):
+    # array-backed token columns: integer kind ids plus start and stop offsets into the source
+    gen = 0
+    def __init__(self, file: File, kinds: list, values: list):
+        self.file, self.kinds, self.values = file, kinds, values
+        self.kind, self.start, self.stop = array("i"), array("q"), array("q")
+    def append(self, kind: int, start: int, stop: int):
+        self.kind.append(kind)
+        self.start.append(start)
+        self.stop.append(stop)
+    def __len__(self):
+        return len(self.kind)
+    def __getitem__(self, idx: int) -> TokenView:
+        if idx < 0: idx += len(self.kind)
+        if not 0 <= idx < len(self.kind): raise IndexError("token index out of range")
+        return TokenView(self, idx)
+    def type(self, idx: int):
+        return self.kinds[self.kind[idx]]
+    def value(self, idx: int):
+        if not self.values[self.kind[idx]]: return None
+        return self.file.text[self.start[idx]:self.stop[idx]]
+    def start_position(self, idx: int) -> Position:
+        return Position(self.start[idx], self.file)
+    def stop_position(self, idx: int) -> Position:
+        return Position(self.stop[idx], self.file)
+    def close(self):
+        pass
+    def __getstate__(self):
+        # offsets travel as 32-bit ints when the source is small enough
+        state = dict(self.__dict__)
+        if self.start is not None and len(self.file.text) < 1 << 31:
+            state["start"], state["stop"] = array("i", self.start), array("i", self.stop)
+        return state
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.start is not None and self.start.typecode != "q":
+            self.start, self.stop = array("q", self.start), array("q", self.stop)
+
+class BareTokens(Tokens):
+    # tokens without positions for jobs that never report locations, the matched values are
+    # kept instead of offsets so the source text can be released once lexing is done
+    def __init__(self, file: File, kinds: list, values: list):
+        super().__init__(file, kinds, values)
+        self.vals = []
+        self.start = self.stop = None
+    def append(self, kind: int, start: int, stop: int):
+        self.kind.append(kind)
+        self.vals.append(self.file.text[start:stop] if self.values[kind] else None)
+    def value(self, idx: int):
+        return self.vals[idx]
+    def start_position(self, idx: int):
+        return None
+    def stop_position(self, idx: int):
+        return None
+    def close(self):
+        self.file = File(self.file.fn, "")
+
+class ByteTokens(Tokens):
+    # tokens of a bytes or mmap source, values are memoryviews into it instead of copies
+    def __init__(self, file: File, kinds: list, values: list):
+        super().__init__(file, kinds, values)
+        self.view = memoryview(file.text)
+    def value(self, idx: int):
+        if not self.values[self.kind[idx]]: return None
+        return self.view[self.start[idx]:self.stop[idx]]
+
+class EditTokens(Tokens):
+    # tokens that llp.relex splices in place. offsets of the tokens from index `gap` on are stored
+    # `shift` characters off, so an edit only rewrites the offsets between it and the previous
+    # edit, and `log` keeps the (first, old end, new end) index range every edit replaced
+    def __init__(self, file: File, kinds: list, values: list):
+        super().__init__(file, kinds, values)
+        self.gap, self.shift = 0, 0
+        self.log = []
+    def close(self):
+        self.gap = len(self.kind)
+    def offset(self, column: array, idx: int) -> int:
+        return column[idx] + self.shift if idx >= self.gap else column[idx]
+    def value(self, idx: int):
+        if not self.values[self.kind[idx]]: return None
+        return self.file.text[self.offset(self.start, idx):self.offset(self.stop, idx)]
+    def start_position(self, idx: int) -> Position:
+        return Position(self.offset(self.start, idx), self.file)
+    def stop_position(self, idx: int) -> Position:
+        return Position(self.offset(self.stop, idx), self.file)
+    def move_gap(self, gap: int):
+        shift = self.shift
+        for column in (self.start, self.stop):
+            if gap < self.gap: column[gap:self.gap] = array("q", map((-shift).__add__, column[gap:self.gap]))
+            elif gap > self.gap: column[self.gap:gap] = array("q", map(shift.__add__, column[self.gap:gap]))
+        self.gap = gap
+    def splice(self, first: int, old_end: int, kinds: array, starts: array, stops: array, file: File):
+        # replaces the tokens [first, old_end) with ones at their offsets in the edited file
+        self.move_gap(old_end)
+        self.kind[first:old_end], self.start[first:old_end], self.stop[first:old_end] = kinds, starts, stops
+        new_end = first + len(kinds)
+        self.gap, self.shift = new_end, self.shift + len(file.text) - len(self.file.text)
+        self.file = file
+        self.log.append((first, old_end, new_end))
+        self.gen += 1
@@ -1,7 +1,169 @@
 import src.lexer as l
 import src.parser as p
+import re
+try: import re._parser as sre_parse
+except ImportError: import sre_parse
 
 
+class PatternError:
+    def __init__(self, msg: str, pattern: str, start: l.Position, stop: l.Position):
+        self.name, self.msg, self.pattern, self.start, self.stop = "pattern error", msg, pattern, start, stop
+    def __str__(self):
+        return f"{self.name}: {self.msg} ('{self.pattern}') (ln {self.start.ln}, col {self.start.col})"
+
+class LinkError:
+    def __init__(self, what: str, name, start: l.Position, stop: l.Position):
+        self.name, self.msg, self.start, self.stop = "link error", f"{what} '{name}' is not defined", start, stop
+    def __str__(self):
+        return f"{self.name}: {self.msg} (ln {self.start.ln}, col {self.start.col})"
+
+# lex always ran rules on the rest of the text, so a rule matches as if the text started at the
+# token. matching in place gives that for everything but assertions at the start of the rule, which
+# would see the text before the token: ^ and \A always hold there, \b and \B depend only on the first
+# character and lookbehinds see nothing. at_start rewrites those, the regex then matches in place
+INLINE = re.compile(r"\(\?[aiLmsux]+\)|\(\?#")
+GROUP = re.compile(r"\((\?(:|>|P<\w+>|[aiLmsux]*-?[imsx]*:)|(?!\?))")
+
+def class_end(s: str, i: int) -> int:
+    # the index after the character class starting at s[i]
+    i += 1
+    if s.startswith("^", i): i += 1
+    if s.startswith("]", i): i += 1
+    while i < len(s) and s[i] != "]": i += 2 if s[i] == "\\" else 1
+    return i + 1
+def group_end(s: str, i: int) -> int:
+    # the index of the ) closing the group starting at s[i]
+    depth = 0
+    while i < len(s):
+        if s[i] == "\\": i += 2; continue
+        if s[i] == "[": i = class_end(s, i); continue
+        if s[i] == "(": depth += 1
+        elif s[i] == ")":
+            depth -= 1
+            if depth == 0: return i
+        i += 1
+    return i
+def branches(s: str) -> list:
+    # s split at the | outside of groups
+    parts, start, i = [], 0, 0
+    while i < len(s):
+        if s[i] == "\\": i += 2; continue
+        if s[i] == "[": i = class_end(s, i); continue
+        if s[i] == "(": i = group_end(s, i)
+        elif s[i] == "|":
+            parts.append(s[start:i])
+            start = i + 1
+        i += 1
+    return parts + [s[start:]]
+
+def at_start(s: str) -> str:
+    # the regex s with the assertions it starts with replaced by what they are at the start of the text
+    return "|".join(map(branch_start, branches(s)))
+def branch_start(s: str) -> str:
+    out, i = [], 0
+    while i < len(s):
+        if s.startswith("^", i): i += 1
+        elif s.startswith("\\A", i): i += 2
+        elif s.startswith("\\b", i): out.append("(?=\\w)"); i += 2
+        elif s.startswith("\\B", i): out.append("(?!\\w)"); i += 2
+        elif not s.startswith("(", i): break
+        else:
+            end = group_end(s, i)
+            # a group only matches at the start once if it doesn't repeat
+            if s.startswith(tuple("*+?{"), end + 1): break
+            if INLINE.match(s, i): out.append(s[i:end+1])
+            elif s.startswith(("(?<=", "(?<!"), i):
+                # a lookbehind looking at no characters is kept
+                if not sre_parse.parse(s[i+4:end]).getwidth()[0]: out.append(s[i:end+1])
+                elif s[i+3] == "=": out.append("(?!)")
+            elif s.startswith(("(?=", "(?!"), i): out.append(s[i:i+3] + at_start(s[i+3:end]) + ")")
+            else:
+                m = GROUP.match(s, i)
+                if m: out.append(m.group() + at_start(s[m.end():end]) + ")")
+                else: break
+                i = end + 1
+                break
+            i = end + 1
+    return "".join(out) + s[i:]
+
+def rule_regex(source: str):
+    # the compiled regex of a lexer rule, raising re.error
+    regex = re.compile(source)
+    if regex.flags & re.VERBOSE: return regex
+    return re.compile(at_start(source))
+
+def compile_pattern(s):
+    try: return rule_regex(s.value), None
+    except re.error as e: return None, PatternError(e.msg, s.value, s.start, s.stop)
+
+def first_codes(seq) -> tuple:
+    # (codes, nullable) of a parsed regex: the character codes a non-empty match can start with,
+    # None when that isn't known, and whether the part before them can match the empty string
+    codes = set()
+    for op, av in seq:
+        if op is sre_parse.LITERAL:
+            codes.add(av)
+            return codes, False
+        if op is sre_parse.IN:
+            for item, arg in av:
+                if item is sre_parse.LITERAL: codes.add(arg)
+                elif item is sre_parse.RANGE and arg[1] - arg[0] < 1024: codes.update(range(arg[0], arg[1] + 1))
+                else: return None, False
+            return codes, False
+        if op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT): continue
+        if op is sre_parse.BRANCH: branches, least = av[1], 1
+        elif op is sre_parse.SUBPATTERN:
+            if av[1] or av[2]: return None, False
+            branches, least = [av[3]], 1
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None): branches, least = [av], 1
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)): branches, least = [av[2]], av[0]
+        else: return None, False
+        nullable = not least
+        for branch in branches:
+            sub, null = first_codes(branch)
+            if sub is None: return None, False
+            codes |= sub
+            nullable = nullable or null
+        if not nullable: return codes, False
+    return codes, True
+
+def literal_run(entries: list) -> tuple:
+    # one entry for consecutive literal rules: ((length, {text: (order, kind, length)}), ...) looked
+    # up by slicing, the first of them in rule order that matches wins
+    words = {}
+    for order, (literal, _, kind) in enumerate(entries): words.setdefault(len(literal), {}).setdefault(literal, (order, kind, len(literal)))
+    return tuple(sorted(words.items())), None, None
+
+def rule_dispatch(rules: list, key) -> tuple:
+    # (table, default) for the lexer loop: the rules to try, in order, for each first character
+    # key(code), and for any other character the rules whose first characters aren't known. the
+    # entries are (literal, pattern, kind), literal is the text of a pattern that matches nothing
+    # else, or a literal_run when at least 4 of them follow each other
+    entries, firsts = [], []
+    for pattern, kind in rules:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+        flags = parsed.state.flags if hasattr(parsed, "state") else parsed.pattern.flags
+        codes, _ = (None, False) if flags & re.IGNORECASE else first_codes(parsed)
+        literal = None
+        if key is chr and len(parsed) and not flags & re.IGNORECASE and all(op is sre_parse.LITERAL for op, _ in parsed):
+            literal = "".join(chr(av) for _, av in parsed)
+        entries.append((literal, pattern, kind))
+        firsts.append(codes)
+    def candidates(c) -> list:
+        out, run = [], []
+        for e, codes in [*zip(entries, firsts), (None, None)]:
+            if e is not None and codes is not None and c not in codes: continue
+            if e is not None and e[0] is not None:
+                run.append(e)
+                continue
+            if len(run) >= 4: out.append(literal_run(run))
+            else: out.extend(run)
+            run = []
+            if e is not None: out.append(e)
+        return out
+    chars = set().union(*(codes for codes in firsts if codes is not None))
+    return {key(c): candidates(c) for c in chars}, candidates(None)
+
 class Base:
     def __init__(self, start: l.Position, stop: l.Position):
         self.start, self.stop = start, stop
@@ -9,7 +171,7 @@ class Base:
         s = f"{self.__class__.__name__}\n"
         attrs = self.__dict__
         for k in attrs:
-            if k in ["start", "stop"]: continue
+            if k in ["start", "stop", "target"]: continue
             if getattr(attrs[k], "convTree", False): s += f"{prefix}{k}: {attrs[k].convTree(prefix+subprefix, subprefix)}"
             elif type(attrs[k]) is list: s += f"{prefix}{k}:\n{self.convList(attrs[k], prefix+subprefix, subprefix)}"
             else: s += f"{prefix}{k}: {repr(attrs[k])}"
@@ -50,6 +212,12 @@ class ID(Base):
     def __init__(self, value: str, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
         self.value = value
+        # the Layer a reference resolves to, set by link()
+        self.target = None
+    def __getstate__(self):
+        # pickled without the target, a chain of layers would pickle as deep as it is long.
+        # Language links its references again when it is unpickled
+        return {**self.__dict__, "target": None}
     def __str__(self):
         return self.value
 class Var(Base):
@@ -62,6 +230,7 @@ class Token(Base):
     def __init__(self, type: str, value, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
         self.type, self.value = type, value
+        self.kind = -1
     def __str__(self):
         return f"[{self.type}{f':{self.value}' if self.value is not None else ''}]"
 class Name(Base):
@@ -88,11 +257,56 @@ class Lexer(Base):
     def __init__(self, tokens: list, ignore: list, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
         self.tokens, self.ignore = tokens, ignore
+        self.rules = []
+        # token kinds are numbered in declaration order after eof, which is always 0
+        self.kinds = [ID("eof", start, stop)]
+        self.kind_ids = {"eof": 0}
+        self.values = [False]
+        self.dispatch = {}, []
+        self.byte_rules = self.byte_dispatch = None
+        # longest -> the rules combined into a dfa.DFA, built by llp.lex_dfa on first use
+        self.dfas = {}
+    def compile(self):
+        # (pattern, kind) pairs in the order the lexer tries them, kind is None for IGNORE patterns
+        rules = []
+        for s in self.ignore:
+            pattern, err = compile_pattern(s)
+            if err: return None, err
+            rules.append((pattern, None))
+        for token in self.tokens:
+            kind = self.kind_ids.get(token.name.value)
+            if kind is None:
+                kind = self.kind_ids[token.name.value] = len(self.kinds)
+                self.kinds.append(token.name)
+                self.values.append(False)
+            if isinstance(token, ValueToken): self.values[kind] = True
+            for s in token.strs:
+                pattern, err = compile_pattern(s)
+                if err: return None, err
+                rules.append((pattern, kind))
+        self.rules, self.byte_rules, self.byte_dispatch, self.dfas = rules, None, None, {}
+        self.dispatch = rule_dispatch(rules, chr)
+        return rules, None
+    def compile_bytes(self):
+        # the dispatch of the rules as bytes patterns for lexing bytes and mmaps, compiled on first
+        # use. classes like \w and . match ASCII characters and single bytes there
+        if self.byte_dispatch is None:
+            rules = []
+            for pattern, kind in self.rules:
+                try: rules.append((re.compile(pattern.pattern.encode(), pattern.flags & ~re.UNICODE), kind))
+                except re.error as e: return None, PatternError(e.msg, pattern.pattern, self.start, self.stop)
+            self.byte_rules, self.byte_dispatch = rules, rule_dispatch(rules, int)
+        return self.byte_dispatch, None
 
 class Layer(Base):
-    def __init__(self, name: str, patterns: list, link_layer: str, start: l.Position, stop: l.Position):
+    def __init__(self, name: str, patterns: list, link_layer: str, start: l.Position, stop: l.Position, sync: list = None):
         super().__init__(start, stop)
         self.name, self.patterns, self.link_layer = name, patterns, link_layer
+        # tokens the parser skips to when recovering from an error inside this layer
+        self.sync = sync or []
+        self.first, self.nullable = set(), False
+        # token kind -> the patterns that can start with it, in order, see predict()
+        self.predict, self.fallback = {}, patterns
 class Pattern(Base):
     def __init__(self, pattern: list, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
@@ -119,26 +333,43 @@ class Binary(Base):
         self.left = group.group[0]
         self.op = group.group[1]
         self.right = group.group[2] if len(group.group) >= 3 else group.group[0]
+        # set by optimize for a layer that links to the left operand: the operand alone is
+        # matched instead of failing when no full operation follows
+        self.optional = False
     def __str__(self):
         return f"(BINARY {self.left} {self.op} {self.right})"
 class To(Base):
     def __init__(self, pattern: Pattern, node: Node, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
         self.pattern, self.node = pattern, node
+        self.first, self.nullable = set(), False
     def __str__(self):
         return f"({self.pattern} -> {self.node})"
+class Factored(Base):
+    # consecutive alternatives of a layer that start with the same elements: the prefix is matched
+    # once and the alternatives go on from there in order. made by optimize
+    def __init__(self, prefix: list, alternatives: list):
+        super().__init__(alternatives[0].start, alternatives[-1].stop)
+        self.prefix, self.alternatives = prefix, alternatives
+        self.first, self.nullable = set(), False
+    def __str__(self):
+        return f"({' '.join(map(str, self.prefix))} | {' | '.join(str(to) for to in self.alternatives)})"
 class Parser(Base):
     def __init__(self, layers: list, start_layer: str, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
         self.layers, self.start_layer = layers, start_layer
+        self.names = {}
+        for layer in layers: self.names.setdefault(layer.name.value, layer)
     def get_layer(self, name: ID):
-        for layer in self.layers:
-            if name.value == layer.name.value: return layer
+        return self.names.get(name.value)
 
 class ErrorCall(Base):
     def __init__(self, name: ID, args: list, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
         self.name, self.args = name, args
+        self.target = None
+    def __getstate__(self):
+        return {**self.__dict__, "target": None}
     def __str__(self):
         return f"(ERROR ({' '.join([f'{e}' for e in self.args])}) )"
 class ErrorDef(Base):
@@ -151,9 +382,10 @@ class Error(Base):
     def __init__(self, defs: list, start: l.Position, stop: l.Position):
         super().__init__(start, stop)
         self.defs = defs
+        self.names = {}
+        for defin in defs: self.names.setdefault(defin.name.value, defin)
     def get_def(self, name: ID):
-        for defin in self.defs:
-            if name.value == defin.name.value: return defin
+        return self.names.get(name.value)
 
 class Language(Base):
     def __init__(self, lexer: Lexer, parser: Parser, error: Error, name: str = "unnamed", extention=None):
@@ -166,6 +398,130 @@ class Language(Base):
         self.error = error
         self.name = name
         self.extention = extention
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.parser: link(self.parser, self.error)
+
+def pattern_str(x) -> str:
+    # grammar notation of a pattern element
+    if isinstance(x, Token): return f"[{':'.join(x.value)}]"
+    if isinstance(x, Repeat): return f"{pattern_str(x.node)}*"
+    if isinstance(x, Group): return f"({' '.join(pattern_str(e) for e in x.group)})"
+    if isinstance(x, Binary): return f"BINARY({pattern_str(x.left)} {pattern_str(x.op)})"
+    return str(x)
+
+def walk(x):
+    # yields x and every pattern element nested in it
+    yield x
+    if isinstance(x, Layer):
+        for to in x.patterns: yield from walk(to)
+        if x.link_layer: yield from walk(x.link_layer)
+    elif isinstance(x, To): yield from walk(x.pattern)
+    elif isinstance(x, Factored):
+        for to in x.alternatives: yield from walk(to)
+    elif isinstance(x, Pattern):
+        for e in x.pattern: yield from walk(e)
+    elif isinstance(x, Group):
+        for e in x.group: yield from walk(e)
+    elif isinstance(x, Repeat): yield from walk(x.node)
+    elif isinstance(x, Binary):
+        yield from walk(x.left)
+        yield from walk(x.op)
+        if x.right is not x.left: yield from walk(x.right)
+
+def link(parser: Parser, error: Error):
+    # resolves every layer and error reference to its definition, so parsing does no name lookups
+    parser.start_layer.target = parser.get_layer(parser.start_layer)
+    if not parser.start_layer.target:
+        return None, LinkError("layer", parser.start_layer, parser.start_layer.start, parser.start_layer.stop)
+    for layer in parser.layers:
+        for x in walk(layer):
+            if isinstance(x, ErrorCall):
+                x.target = error.get_def(x.name) if error else None
+                if not x.target: return None, LinkError("error", x.name, x.name.start, x.name.stop)
+            elif isinstance(x, ID):
+                x.target = parser.get_layer(x)
+                if not x.target: return None, LinkError("layer", x, x.start, x.stop)
+    return parser, None
+
+# FIRST set marker of elements that do not just fail on an unexpected token, like ERROR links
+ANY = -2
+
+def first(x, parser: Parser) -> tuple:
+    # (FIRST set, nullable) of a pattern element with the layers' current FIRST sets
+    if isinstance(x, Token): return ({x.kind} if x.kind >= 0 else set()), False
+    if isinstance(x, ID):
+        layer = x.target
+        return (layer.first, layer.nullable) if layer else ({ANY}, False)
+    if isinstance(x, Group):
+        kinds, nullable = set(), False
+        for e in x.group:
+            f, n = first(e, parser)
+            kinds |= f
+            nullable = nullable or n
+        return kinds, nullable
+    if isinstance(x, Repeat): return first(x.node, parser)
+    if isinstance(x, Binary): return first_seq([x.left, x.op, x.right], parser)
+    return {ANY}, False
+def first_seq(elements: list, parser: Parser) -> tuple:
+    kinds = set()
+    for e in elements:
+        f, n = first(e, parser)
+        kinds |= f
+        if not n: return kinds, False
+    return kinds, True
+
+def first_layer(layer: Layer, parser: Parser) -> tuple:
+    # (FIRST set, nullable) of a layer with the other layers' current FIRST sets, sets those of
+    # its patterns on the way
+    kinds, nullable = set(), False
+    for to in layer.patterns:
+        if isinstance(to, To):
+            to.first, to.nullable = first_seq(to.pattern.pattern, parser)
+            kinds |= to.first
+            nullable = nullable or to.nullable
+        elif isinstance(to, Factored):
+            to.first, to.nullable = set(), False
+            for alternative in to.alternatives:
+                f, n = first_seq(alternative.pattern.pattern, parser)
+                to.first |= f
+                to.nullable = to.nullable or n
+            kinds |= to.first
+            nullable = nullable or to.nullable
+        else: kinds.add(ANY)
+    if layer.link_layer:
+        f, n = first(layer.link_layer, parser)
+        kinds |= f
+        nullable = nullable or n
+    return kinds, nullable
+
+def predict(parser: Parser):
+    # computes FIRST sets up to a fixpoint, then lets every layer jump to the patterns that can
+    # start with the current token: a pattern whose FIRST set lacks it would fail without
+    # consuming anything or raising an error, so skipping it matches the same way.
+    # a layer is computed again only when a layer it refers to changed
+    users = {layer: [] for layer in parser.layers}
+    for layer in parser.layers:
+        for target in {id(x.target): x.target for x in walk(layer) if isinstance(x, ID) and x.target in users}.values():
+            users[target].append(layer)
+    for layer in parser.layers: layer.first, layer.nullable = set(), False
+    queue, queued = list(reversed(parser.layers)), set(parser.layers)
+    while queue:
+        layer = queue.pop()
+        queued.discard(layer)
+        kinds, nullable = first_layer(layer, parser)
+        if kinds != layer.first or nullable != layer.nullable:
+            layer.first, layer.nullable = kinds, nullable
+            for user in users[layer]:
+                if user not in queued:
+                    queued.add(user)
+                    queue.append(user)
+    for layer in parser.layers:
+        always = lambda to: not isinstance(to, (To, Factored)) or to.nullable or ANY in to.first
+        layer.fallback = [to for to in layer.patterns if always(to)]
+        layer.predict = {}
+        for kind in sorted({kind for to in layer.patterns if isinstance(to, (To, Factored)) for kind in to.first} - {ANY}):
+            layer.predict[kind] = [to for to in layer.patterns if always(to) or kind in to.first]
 
 class Transform:
     def visit(self, node):
@@ -290,7 +646,12 @@ class Transform:
         if err: return None, err
         name, err = self.visit(node.name)
         if err: return None, err
-        return Layer(name, patterns, link_layer, node.start, node.stop), None
+        sync = []
+        for tok in node.sync:
+            tok, err = self.visit(tok)
+            if err: return None, err
+            sync.append(tok)
+        return Layer(name, patterns, link_layer, node.start, node.stop, sync), None
     def visit_ParserNode(self, node: p.ParserNode) -> Parser:
         layers, err = self.visit(node.body)
         if err: return None, err
@@ -305,6 +666,7 @@ class Transform:
 def transform(body: p.BodyNode) -> Language:
     transform = Transform()
     elements, err = transform.visit(body)
+    if err: return None, err
     name, extention, lexer, parser, error = None, None, None, None, None
     for v in elements:
         if isinstance(v, Name): name = v.name
@@ -312,4 +674,14 @@ def transform(body: p.BodyNode) -> Language:
         if isinstance(v, Lexer): lexer = v
         if isinstance(v, Parser): parser = v
         if isinstance(v, Error): error = v
+    if lexer:
+        _, err = lexer.compile()
+        if err: return None, err
+    if parser:
+        for layer in parser.layers:
+            for x in [*walk(layer), *layer.sync]:
+                if isinstance(x, Token) and lexer: x.kind = lexer.kind_ids.get(x.value[0], -1)
+        _, err = link(parser, error)
+        if err: return None, err
+        predict(parser)
     return Language(lexer, parser, error, name, extention), None
\ No newline at end of file
@@ -0,0 +1,65 @@
+import os, itertools, importlib.util
+from collections.abc import Mapping
+from main import *
+from src import llp, cache
+
+# the module compile writes has to give the same (ast, err) as llp.parse
+MATH = ["1", "2.5", ".5", "+", "-", "*", "/", "(", ")", " "]
+DEF = ["public ", "define ", "main", "\n", "print ", "1 ", "2.5 ", "end", "(", ")", " ab ", "# c"]
+INPUTS = [
+    ("math.llp", open("test.math").read()),
+    ("math.llp", "(1 + 2) * -3"),
+    ("math.llp", "1 + 2 * 3 - 4 / 5.5 - -(6)"),
+    ("math.llp", "((((1))))"),
+    ("math.llp", "1 +"),
+    ("math.llp", "(1"),
+    ("math.llp", "1 + $"),
+    ("def.llp", open("test.def").read()),
+    ("def.llp", open("errors.def").read()),
+    ("def.llp", "public define main\n    print 1\n    print (2)\nend\ndefine foo\nprint 3.5\nend"),
+    ("def.llp", "public define main\n    print x\nend"),
+    ("def.llp", "define\n"),
+]
+
+def norm(x):
+    # an ast as plain values, tokens as their kind, value and positions
+    if isinstance(x, list) or type(x).__name__ == "ListView": return [norm(e) for e in x]
+    if isinstance(x, Mapping):
+        if hasattr(x["type"], "value"):
+            return x["type"].value, x["value"], x["start"].idx, x["stop"].idx, x["start"].ln, x["start"].col, x["stop"].ln, x["stop"].col
+        return {k: norm(v) for k, v in x.items()}
+    return x
+
+def load_compiled(llp_fn: str):
+    # written next to the cached grammars
+    out_dir = os.path.join(os.path.dirname(llp_fn), cache.DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    out_fn = os.path.join(out_dir, os.path.basename(llp_fn).replace(".", "_") + ".py")
+    compile_grammar(llp_fn, out_fn)
+    spec = importlib.util.spec_from_file_location(os.path.basename(out_fn)[:-3], out_fn)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def parsed(text: str, lang) -> tuple:
+    tokens, err = llp.lex("<text-input>", text, lang.lexer)
+    if err: return None, str(err)
+    ast, err = llp.parse(tokens, lang.parser, lang.error)
+    return norm(ast), str(err) if err else None
+
+if __name__ == '__main__':
+    # besides the inputs above every sequence of up to 3 of the pieces
+    inputs = INPUTS + [(llp_fn, "".join(seq)) for llp_fn, pieces in (("math.llp", MATH), ("def.llp", DEF))
+                       for n in range(4) for seq in itertools.product(pieces, repeat=n)]
+    modules = {llp_fn: load_compiled(llp_fn) for llp_fn in ("math.llp", "def.llp")}
+    langs = {llp_fn: load_language(llp_fn) for llp_fn in modules}
+    failed = 0
+    for llp_fn, text in inputs:
+        want = parsed(text, langs[llp_fn])
+        ast, err = modules[llp_fn].from_text(text)
+        got = norm(ast), str(err) if err else None
+        if got != want:
+            failed += 1
+            if failed <= 5: print(f"{llp_fn} {repr(text)}:\n  llp:      {want}\n  compiled: {got}")
+    print(f"{len(inputs) - failed} of {len(inputs)} the same")
+    if failed: exit(1)
@@ -38,4 +38,4 @@ class Def(Interpreter):
         if 'main' not in self.public: return None, False, 'no public main definition'
         return self.visit(self.variables['main'])
 
-run(Def, 'def.llp', 'test.def', False)
\ No newline at end of file
+if __name__ == '__main__': run(Def, 'def.llp', 'test.def', False)
\ No newline at end of file
@@ -1,14 +1,14 @@
 from main import *
 
-class Math(Interpreter):
+class Math(StackInterpreter):
     def visit_Int(self, node: dict):
         return int(node["tok"]["value"]), None
     def visit_Float(self, node: dict):
         return float(node["tok"]["value"]), None
     def visit_BinaryOperation(self, node: dict):
-        left, err = self.visit(node["left"])
+        left, err = yield node["left"]
         if err: return None, err
-        right, err = self.visit(node["right"])
+        right, err = yield node["right"]
         if err: return None, err
         if node["op"]['type'].value == "add": return left + right, None
         if node["op"]['type'].value == "sub": return left - right, None
@@ -16,10 +16,10 @@ class Math(Interpreter):
         if node["op"]['type'].value == "div": return left / right, None
         return None, f"unsupported binary operation '{node['op']['type']}'"
     def visit_UnaryOperation(self, node: dict):
-        value, err = self.visit(node["node"])
+        value, err = yield node["node"]
         if err: return None, err
         if node["op"]['type'].value == "add": return value, None
         if node["op"]['type'].value == "sub": return -value, None
         return None, f"unsupported unary operation '{node['op']['type']}'"
 
-run(Math, "math.llp", "test.math")
\ No newline at end of file
+if __name__ == '__main__': run(Math, "math.llp", "test.math")
\ No newline at end of file
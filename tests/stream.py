@@ -0,0 +1,42 @@
+import io
+from main import *
+from src import llp
+
+# lex_stream has to give the tokens and errors llp.lex gives, whatever the chunk size
+CHUNK_SIZES = (1, 2, 3, 5, 7, 64, 1 << 16)
+INPUTS = [
+    ("def.llp", open("test.def").read()),
+    ("def.llp", open("errors.def").read()),
+    ("def.llp", "public define main\n    print 1 # c\n    print 2\nend\n"),
+    ("def.llp", "public define main\n    print 1\nend # c\n"),
+    ("def.llp", "public define main\n    print 1\nend # c\n\n"),
+    ("def.llp", "public define main\n    print 1\nend # c"),
+    ("math.llp", open("test.math").read()),
+    ("math.llp", "1.5 + .5 * (2. - 3)"),
+    ("math.llp", "1 + $"),
+]
+
+def lexed(text: str, lexer) -> tuple:
+    tokens, err = llp.lex("<t>", text, lexer)
+    if err: return None, err.start.idx
+    return [(tokens.kind[k], tokens.start[k], tokens.stop[k]) for k in range(len(tokens))], None
+def streamed(text: str, lexer, chunk_size: int) -> tuple:
+    out = []
+    for kind, tok, err in llp.lex_stream(llp.File("<t>", ""), io.StringIO(text), lexer, chunk_size):
+        if err: return None, err.start.idx
+        out.append((kind, tok["start"].idx, tok["stop"].idx))
+    return out, None
+
+if __name__ == '__main__':
+    failed = 0
+    for llp_fn, text in INPUTS:
+        lexer = load_language(llp_fn).lexer
+        want = lexed(text, lexer)
+        for chunk_size in CHUNK_SIZES:
+            got = streamed(text, lexer, chunk_size)
+            if got != want:
+                failed += 1
+                print(f"{llp_fn} {repr(text[:30])} chunk_size {chunk_size}: {got[1]} instead of {want[1]}" if got[1] != want[1] else
+                      f"{llp_fn} {repr(text[:30])} chunk_size {chunk_size}: different tokens")
+    print(f"{len(INPUTS) * len(CHUNK_SIZES) - failed} of {len(INPUTS) * len(CHUNK_SIZES)} the same")
+    if failed: exit(1)